@@ -0,0 +1,316 @@
+import asyncio
+import bisect
+import logging
+import sqlite3
+import time
+from collections import Counter
+from typing import NamedTuple, Optional, Protocol
+import redis.asyncio as async_redis
+
+
+logger = logging.getLogger()
+
+#  верхние границы корзин времени прохождения квиза, секунды; последняя - всё, что дольше
+DURATION_BUCKETS = (15, 30, 45, 60, 90, 120, 180, 300, 600, 1800, 3600, float('inf'))
+
+
+def _decode(value: bytes | str) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class AnalyticsEvent(NamedTuple):
+    """start - нажата кнопка начала квиза, answer - ответ на вопрос position,
+    result - квиз пройден, psychotype - индекс итогового психотипа"""
+
+    kind: str
+    quiz_id: str
+    quiz_version: int
+    user_id: int
+    position: int = 0
+    psychotype: int = -1
+    duration: float = 0.0
+    at: float = 0.0
+
+    def to_fields(self) -> dict[str, str | int | float]:
+        return {'k': self.kind, 'q': self.quiz_id, 'v': self.quiz_version, 'u': self.user_id,
+                'p': self.position, 's': self.psychotype, 'd': self.duration, 't': self.at}
+
+    @classmethod
+    def from_fields(cls, fields: dict) -> 'AnalyticsEvent':
+        fields = {_decode(name): _decode(value) for name, value in fields.items()}
+        return cls(kind=fields['k'], quiz_id=fields['q'], quiz_version=int(fields['v']), user_id=int(fields['u']),
+                   position=int(fields['p']), psychotype=int(fields['s']), duration=float(fields['d']),
+                   at=float(fields['t']))
+
+
+class AnalyticsSink(Protocol):
+
+    async def write(self, events: list[AnalyticsEvent]) -> None:
+        ...
+
+    async def close(self) -> None:
+        ...
+
+
+class AnalyticsDB:
+    """SQLite с сырыми событиями и свёртками по ним.
+
+    Свёртки обновляются в той же транзакции, что и вставка пачки событий, поэтому отчёт
+    читает только их и не зависит от числа накопленных событий.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS events (
+        kind TEXT NOT NULL, quiz_id TEXT NOT NULL, quiz_version INTEGER NOT NULL, user_id INTEGER NOT NULL,
+        position INTEGER NOT NULL, psychotype INTEGER NOT NULL, duration REAL NOT NULL, at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS starts_rollup (
+        quiz_id TEXT NOT NULL, quiz_version INTEGER NOT NULL, count INTEGER NOT NULL,
+        PRIMARY KEY (quiz_id, quiz_version)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS answers_rollup (
+        quiz_id TEXT NOT NULL, quiz_version INTEGER NOT NULL, position INTEGER NOT NULL,
+        psychotype INTEGER NOT NULL, count INTEGER NOT NULL,
+        PRIMARY KEY (quiz_id, quiz_version, position, psychotype)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS results_rollup (
+        quiz_id TEXT NOT NULL, quiz_version INTEGER NOT NULL, psychotype INTEGER NOT NULL,
+        duration_bucket INTEGER NOT NULL, count INTEGER NOT NULL, duration_sum REAL NOT NULL,
+        PRIMARY KEY (quiz_id, quiz_version, psychotype, duration_bucket)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS cursors (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+    """
+
+    def __init__(self, db_path: str):
+        self.connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(self.SCHEMA)
+
+    def apply(self, events: list[AnalyticsEvent], cursor: Optional[tuple[str, str]] = None) -> None:
+        """Сохраняет пачку событий и обновляет свёртки. cursor - (имя, значение) позиции
+        в источнике событий, сохраняется в той же транзакции"""
+
+        starts, answers, results, durations = Counter(), Counter(), Counter(), Counter()
+
+        for event in events:
+            quiz_key = (event.quiz_id, event.quiz_version)
+            if event.kind == 'start':
+                starts[quiz_key] += 1
+            elif event.kind == 'answer':
+                answers[(*quiz_key, event.position, event.psychotype)] += 1
+            elif event.kind == 'result':
+                result_key = (*quiz_key, event.psychotype, bisect.bisect_left(DURATION_BUCKETS, event.duration))
+                results[result_key] += 1
+                durations[result_key] += event.duration
+
+        connection = self.connection
+        connection.execute('BEGIN')
+        try:
+            connection.executemany('INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?)', events)
+            connection.executemany('INSERT INTO starts_rollup VALUES (?, ?, ?) '
+                                   'ON CONFLICT (quiz_id, quiz_version) '
+                                   'DO UPDATE SET count = count + excluded.count',
+                                   ((*key, count) for key, count in starts.items()))
+            connection.executemany('INSERT INTO answers_rollup VALUES (?, ?, ?, ?, ?) '
+                                   'ON CONFLICT (quiz_id, quiz_version, position, psychotype) '
+                                   'DO UPDATE SET count = count + excluded.count',
+                                   ((*key, count) for key, count in answers.items()))
+            connection.executemany('INSERT INTO results_rollup VALUES (?, ?, ?, ?, ?, ?) '
+                                   'ON CONFLICT (quiz_id, quiz_version, psychotype, duration_bucket) '
+                                   'DO UPDATE SET count = count + excluded.count, '
+                                   'duration_sum = duration_sum + excluded.duration_sum',
+                                   ((*key, count, durations[key]) for key, count in results.items()))
+            if cursor is not None:
+                connection.execute('INSERT OR REPLACE INTO cursors VALUES (?, ?)', cursor)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def get_cursor(self, name: str, default: str = '0') -> str:
+        row = self.connection.execute('SELECT value FROM cursors WHERE name = ?', (name, )).fetchone()
+        return row[0] if row else default
+
+    def report(self, quiz_id: Optional[str] = None) -> list[dict]:
+        """Сводка по каждой версии квиза: распределение ответов по вопросам, доли психотипов,
+        отвал на каждом вопросе и время прохождения"""
+
+        quiz_filter, params = ('WHERE quiz_id = ?', (quiz_id, )) if quiz_id else ('', ())
+        reports = {}
+
+        def quiz_report(row_quiz_id: str, quiz_version: int) -> dict:
+            return reports.setdefault((row_quiz_id, quiz_version),
+                                      {'quiz_id': row_quiz_id, 'quiz_version': quiz_version, 'started': 0,
+                                       'answers': {}, 'results': Counter(), 'durations': Counter(),
+                                       'duration_sum': 0.0})
+
+        for row_quiz_id, quiz_version, count in self.connection.execute(
+                f'SELECT quiz_id, quiz_version, count FROM starts_rollup {quiz_filter}', params):
+            quiz_report(row_quiz_id, quiz_version)['started'] = count
+
+        for row_quiz_id, quiz_version, position, psychotype, count in self.connection.execute(
+                f'SELECT quiz_id, quiz_version, position, psychotype, count FROM answers_rollup {quiz_filter}', params):
+            quiz_report(row_quiz_id, quiz_version)['answers'].setdefault(position, Counter())[psychotype] = count
+
+        for row_quiz_id, quiz_version, psychotype, bucket, count, duration_sum in self.connection.execute(
+                f'SELECT quiz_id, quiz_version, psychotype, duration_bucket, count, duration_sum '
+                f'FROM results_rollup {quiz_filter}', params):
+            report = quiz_report(row_quiz_id, quiz_version)
+            report['results'][psychotype] += count
+            report['durations'][bucket] += count
+            report['duration_sum'] += duration_sum
+
+        for report in reports.values():
+            answered = {position: sum(counts.values()) for position, counts in report['answers'].items()}
+            reached = report['started']
+            report['drop_off'] = {}
+            for position in range(max(answered, default=-1) + 1):
+                report['drop_off'][position] = reached - answered.get(position, 0)
+                reached = answered.get(position, 0)
+
+            completed = sum(report['results'].values())
+            report['completed'] = completed
+            duration_sum = report.pop('duration_sum')
+            report['duration_mean'] = duration_sum / completed if completed else None
+            report['duration_median'] = duration_percentile(report['durations'], 50)
+            report['duration_p90'] = duration_percentile(report['durations'], 90)
+
+        return sorted(reports.values(), key=lambda item: (item['quiz_id'], item['quiz_version']))
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def duration_percentile(buckets: Counter, percent: float) -> Optional[float]:
+    """Верхняя граница корзины, в которую попадает перцентиль"""
+
+    total = sum(buckets.values())
+    if not total:
+        return None
+    seen = 0
+    for bucket in sorted(buckets):
+        seen += buckets[bucket]
+        if seen * 100 >= total * percent:
+            return DURATION_BUCKETS[bucket]
+
+
+class SQLiteAnalyticsSink:
+
+    def __init__(self, db_path: str):
+        self.db = AnalyticsDB(db_path)
+
+    async def write(self, events: list[AnalyticsEvent]) -> None:
+        #  запись в SQLite блокирующая - в отдельном потоке, чтобы не держать цикл событий
+        await asyncio.to_thread(self.db.apply, events)
+
+    async def close(self) -> None:
+        self.db.close()
+
+
+class RedisStreamAnalyticsSink:
+    """События в Redis Stream; свёртки по нему строит команда отчёта, забирая новые записи"""
+
+    def __init__(self, redis_client: async_redis.Redis, stream: str = 'analytics', maxlen: int = 10_000_000):
+        self.redis_client = redis_client
+        self.stream = stream
+        self.maxlen = maxlen
+
+    async def write(self, events: list[AnalyticsEvent]) -> None:
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            for event in events:
+                pipe.xadd(self.stream, event.to_fields(), maxlen=self.maxlen, approximate=True)
+            await pipe.execute()
+
+    async def close(self) -> None:
+        pass
+
+
+async def ingest_stream(redis_client: async_redis.Redis, stream: str, db: AnalyticsDB, count: int = 10_000) -> int:
+    """Дописывает в свёртки записи потока после сохранённой позиции, возвращает их число"""
+
+    cursor_name = f'stream:{stream}'
+    last_id = db.get_cursor(cursor_name)
+    ingested = 0
+
+    while entries := await redis_client.xrange(stream, min=f'({last_id}', count=count):
+        last_id = _decode(entries[-1][0])
+        await asyncio.to_thread(db.apply, [AnalyticsEvent.from_fields(fields) for _, fields in entries],
+                                (cursor_name, last_id))
+        ingested += len(entries)
+
+    return ingested
+
+
+class Analytics:
+    """Буфер событий квиза в памяти процесса.
+
+    Хендлер только дописывает событие в список, пачку в хранилище отправляет фоновая
+    задача: когда набралось batch_size событий или прошло flush_interval секунд.
+    Без хранилища события не собираются.
+    """
+
+    def __init__(self,
+                 sink: Optional[AnalyticsSink] = None,
+                 batch_size: int = 500,
+                 flush_interval: float = 5.0,
+                 max_buffer_size: int = 100_000):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer_size = max_buffer_size
+        self.counters = Counter(recorded=0, flushed=0, dropped=0)
+        self._buffer: list[AnalyticsEvent] = []
+        self._batch_ready = asyncio.Event()
+        self._closing = False
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, kind: str, quiz_id: str, quiz_version: int, user_id: int, **fields) -> None:
+        if self.sink is None:
+            return
+
+        if len(self._buffer) >= self.max_buffer_size:
+            self.counters['dropped'] += 1
+            return
+
+        self._buffer.append(AnalyticsEvent(kind, quiz_id, quiz_version, user_id, at=time.time(), **fields))
+        self.counters['recorded'] += 1
+
+        if len(self._buffer) >= self.batch_size:
+            self._batch_ready.set()
+
+    def start(self) -> None:
+        if self.sink is not None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        while self._buffer:
+            events, self._buffer = self._buffer[:self.batch_size], self._buffer[self.batch_size:]
+            try:
+                await self.sink.write(events)
+            except Exception as err:
+                logger.error('Analytics flush failed: %s', err, exc_info=True)
+                #  пачка возвращается в буфер и уйдёт со следующей попыткой, если есть место
+                kept = events[:max(self.max_buffer_size - len(self._buffer), 0)]
+                self._buffer[:0] = kept
+                self.counters['dropped'] += len(events) - len(kept)
+                return
+            self.counters['flushed'] += len(events)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._closing = True
+            self._batch_ready.set()
+            await self._task
+        if self.sink is not None:
+            await self.flush()
+            await self.sink.close()
@@ -1,7 +1,11 @@
+from functools import lru_cache
 from aiogram.types import InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 
+#  клавиатуры не меняются после создания, поэтому одна и та же разметка
+#  переиспользуется во всех сообщениях с этим текстом
+@lru_cache(maxsize=256)
 def get_start_button(button_text: str):
     builder = InlineKeyboardBuilder()
     builder.add(InlineKeyboardButton(text=button_text,
@@ -9,6 +13,7 @@ def get_start_button(button_text: str):
     return builder.as_markup()
 
 
+@lru_cache(maxsize=256)
 def get_url_button(text: str, url: str):
     builder = InlineKeyboardBuilder()
     builder.add(InlineKeyboardButton(text=text, url=url))
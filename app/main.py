@@ -1,14 +1,34 @@
 import asyncio
 import logging
+import socket
 from os import getenv
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
 from aiogram.fsm.storage.memory import SimpleEventIsolation
-from aiogram.fsm.storage.redis import RedisStorage
 from aiogram.utils.callback_answer import CallbackAnswerMiddleware
+from analytics import Analytics, RedisStreamAnalyticsSink, SQLiteAnalyticsSink
 from handlers import router
-from redis_db import redis_client
-from middlewares import ThrottlingMessagesMiddleware
+from metrics import (UpdateMetricsMiddleware, HandlerMetricsMiddleware,
+                     TelegramMetricsRequestMiddleware, register_counters, start_metrics_server)
+from redis_batch import BatchingRedisStorage
+from redis_db import get_cache_key_prefix, get_fsm_redis_client, get_redis_client, is_shared_pool
+from middlewares import RedisBatchMiddleware, ThrottlingMiddleware
+from outbox import Outbox
+from photos import PhotoCache
+from polling import UpdateOffsetStore, run_polling
+from quiz import DEFAULT_QUIZ_ID, QUIZZES_FOLDER, QuizRegistry
+from ratelimit import RateLimitRequestMiddleware
+from session import SessionStore
+from shutdown import Shutdown
+from stream import UpdatesPublisherMiddleware, consume_updates
+from webhook import run_webhook
+
+
+def log_warm_up_error(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(f'Photo cache warm up failed: {task.exception()}', exc_info=task.exception())
 
 
 async def start_bot() -> None:
@@ -17,29 +37,174 @@ async def start_bot() -> None:
                         format='%(asctime)s - %(levelname)s - %(message)s',
                         encoding='utf-8')
 
-    redis_fsm_dsn = getenv('REDIS_FSM_DSN')
-    redis_fsm = RedisStorage.from_url(redis_fsm_dsn)
+    quiz_registry = QuizRegistry(getenv('QUIZZES_FOLDER') or QUIZZES_FOLDER, getenv('DEFAULT_QUIZ') or DEFAULT_QUIZ_ID)
+    quiz_registry.load()
+
+    shared_pool = is_shared_pool()
+    cache_key_prefix = get_cache_key_prefix()
+    redis_client = get_redis_client()
+
+    #  брошенные квизы истекают вместе с состоянием FSM, 0 - хранить бессрочно
+    session_ttl = int(getenv('SESSION_TTL', 7 * 24 * 3600))
+    redis_fsm = BatchingRedisStorage(redis=get_fsm_redis_client(), state_ttl=session_ttl or None)
+    session_store = SessionStore(redis_fsm.redis, quiz_registry, ttl=session_ttl)
 
     token = getenv('BOT_TOKEN')
-    bot = Bot(token=token, parse_mode=ParseMode.HTML)
-    await bot.delete_webhook(drop_pending_updates=True)
+    #  свой сервер Bot API: локальный telegram-bot-api или заглушка из benchmarks/loadtest
+    api_url = getenv('TELEGRAM_API_URL')
+    session = AiohttpSession(api=TelegramAPIServer.from_base(api_url)) if api_url else None
+    bot = Bot(token=token, session=session, parse_mode=ParseMode.HTML)
+    rate_limiter = RateLimitRequestMiddleware(global_rate=float(getenv('TELEGRAM_GLOBAL_RATE', 30)))
+    bot.session.middleware(rate_limiter)
+    bot.session.middleware(TelegramMetricsRequestMiddleware())
+
+    bot_mode = getenv('BOT_MODE', 'polling')
+
+    # standalone - принимает и обрабатывает апдейты сам,
+    # ingress - только складывает апдейты в общий поток, worker - только обрабатывает их из потока
+    bot_role = getenv('BOT_ROLE', 'standalone')
+    updates_stream = cache_key_prefix + getenv('UPDATES_STREAM', 'updates')
+
+    if bot_role == 'worker':
+        events_isolation = redis_fsm.create_isolation()
+    else:
+        events_isolation = SimpleEventIsolation()
+
+    outbox = Outbox()
+
+    #  sqlite - события и свёртки в файле процесса, redis - общий поток для нескольких процессов
+    analytics_sink = getenv('ANALYTICS_SINK', '')
+    if analytics_sink == 'sqlite':
+        analytics_sink = SQLiteAnalyticsSink(getenv('ANALYTICS_SQLITE_PATH', 'analytics.sqlite3'))
+    elif analytics_sink == 'redis':
+        analytics_sink = RedisStreamAnalyticsSink(redis_client,
+                                                  cache_key_prefix + getenv('ANALYTICS_STREAM', 'analytics'))
+    analytics = Analytics(analytics_sink or None,
+                          batch_size=int(getenv('ANALYTICS_BATCH_SIZE', 500)),
+                          flush_interval=float(getenv('ANALYTICS_FLUSH_INTERVAL', 5)))
+
+    photo_cache = PhotoCache(redis_client, key_prefix=f'{cache_key_prefix}photo:')
+    photo_cache_chat_id = getenv('PHOTO_CACHE_CHAT_ID')
+    photo_cache_warm_ups: set[asyncio.Task] = set()
+
+    def warm_up_photo_cache() -> None:
+        """Прогревает кэш картинками текущих версий квизов, при перезагрузке - заново"""
+
+        #  прогрев не задерживает первый апдейт: пока он идёт, send_photo сам
+        #  дочитывает или загружает нужную картинку под той же блокировкой
+        psychotypes_images = {image_hash: image for quiz in quiz_registry for image_hash, image in quiz.images.items()}
+        if photo_cache_chat_id:
+            warm_up = photo_cache.warm_up(bot, int(photo_cache_chat_id), psychotypes_images)
+        else:
+            warm_up = photo_cache.load(psychotypes_images)
+        warm_up = asyncio.create_task(warm_up)
+        photo_cache_warm_ups.add(warm_up)
+        warm_up.add_done_callback(photo_cache_warm_ups.discard)
+        warm_up.add_done_callback(log_warm_up_error)
+
+    warm_up_photo_cache()
+    #  картинки квизов, добавленных по SIGHUP или при изменении файлов
+    quiz_registry.add_reload_callback(warm_up_photo_cache)
 
-    dp = Dispatcher(events_isolation=SimpleEventIsolation(),
+    dp = Dispatcher(events_isolation=events_isolation,
                     storage=redis_fsm,
-                    redis_client=redis_client)
+                    redis_client=redis_client,
+                    photo_cache=photo_cache,
+                    session_store=session_store,
+                    quiz_registry=quiz_registry,
+                    outbox=outbox,
+                    analytics=analytics)
 
+    #  Dispatcher регистрирует FSMContextMiddleware первым, а внешние middleware апдейтов
+    #  должны работать до него, поэтому он переставляется в конец цепочки (см. ниже):
+    #  ingress публикует апдейты без блокировки чата и чтения состояния FSM,
+    #  метрики апдейта в любом режиме включают чтение состояния и ожидание блокировки
+    dp.update.outer_middleware.unregister(dp.fsm)
+
+    if bot_role == 'ingress':
+        dp.update.outer_middleware(UpdatesPublisherMiddleware(redis_client, updates_stream))
+
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
     dp.callback_query.middleware(CallbackAnswerMiddleware())
-    dp.message.middleware(ThrottlingMessagesMiddleware(redis_client))
+
+    messages_throttling = ThrottlingMiddleware(redis_client, key_prefix=f'{cache_key_prefix}throttle:message:')
+    dp.message.middleware(messages_throttling)
+    throttling_by_event = {'message': messages_throttling}
+
+    #  повторные нажатия на кнопки тоже можно отсекать, на них всё равно ответит CallbackAnswerMiddleware
+    throttle_callbacks_secs = float(getenv('THROTTLE_CALLBACKS_SECS', 0))
+    if throttle_callbacks_secs:
+        callbacks_throttling = ThrottlingMiddleware(redis_client,
+                                                    flood_wait_secs=throttle_callbacks_secs,
+                                                    key_prefix=f'{cache_key_prefix}throttle:callback:')
+        dp.callback_query.middleware(callbacks_throttling)
+        throttling_by_event['callback_query'] = callbacks_throttling
+        register_counters('bot_callbacks_throttling', 'Callback queries throttling', callbacks_throttling.counters)
+
+    #  в общем пуле окно троттлинга открывается в одном пайплайне с чтением состояния FSM,
+    #  для этого пакет команд апдейта должен открываться до FSMContextMiddleware
+    if shared_pool:
+        dp.update.outer_middleware(RedisBatchMiddleware(throttling_by_event))
+
+    dp.update.outer_middleware(dp.fsm)
+
+    #  регистрируются последними, чтобы измерять только сами хендлеры
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
+
+    register_counters('bot_messages_throttling', 'Messages throttling', messages_throttling.counters)
+    register_counters('bot_analytics_events', 'Quiz analytics events', analytics.counters)
+    register_counters('bot_telegram_rate_limiter', 'Bot API calls passed through the rate limiter',
+                      rate_limiter.counters)
+
+    metrics_port = getenv('METRICS_PORT')
+    metrics_runner = None
+    if metrics_port:
+        metrics_runner = await start_metrics_server(getenv('METRICS_HOST', '0.0.0.0'), int(metrics_port))
+
     dp.include_routers(router)
 
+    #  квизы перечитываются по SIGHUP и, если задан интервал, при изменении файлов
+    quiz_registry.install_sighup_handler()
+    quiz_reload_interval = float(getenv('QUIZ_RELOAD_INTERVAL', 0))
+    quizzes_watcher = asyncio.create_task(quiz_registry.watch(quiz_reload_interval)) if quiz_reload_interval else None
+
+    analytics.start()
+
+    #  по SIGTERM бот перестаёт брать апдейты и за SHUTDOWN_TIMEOUT секунд доделывает
+    #  начатые хендлеры и очередь исходящих запросов
+    shutdown = Shutdown(timeout=float(getenv('SHUTDOWN_TIMEOUT', 20)))
+    shutdown.install_signal_handlers()
+
     try:
-        await dp.start_polling(bot)
+        if bot_role == 'worker':
+            await consume_updates(dp, bot, redis_client,
+                                  stream=updates_stream,
+                                  group=getenv('UPDATES_STREAM_GROUP', 'workers'),
+                                  consumer=getenv('WORKER_NAME') or socket.gethostname(),
+                                  shutdown=shutdown,
+                                  batch_size=int(getenv('WORKER_BATCH_SIZE', 100)),
+                                  max_concurrency=int(getenv('WORKER_MAX_CONCURRENCY', 100)))
+        elif bot_mode == 'webhook':
+            await run_webhook(dp, bot, shutdown)
+        else:
+            offset_store = UpdateOffsetStore(redis_client, f'{cache_key_prefix}polling:offset:{bot.id}')
+            await run_polling(dp, bot, offset_store, shutdown,
+                              max_concurrency=int(getenv('POLLING_MAX_CONCURRENCY', 100)))
     except Exception as err:
         logging.error(f'{err}', exc_info=True)
     finally:
+        for warm_up in tuple(photo_cache_warm_ups):
+            warm_up.cancel()
+        if quizzes_watcher is not None:
+            quizzes_watcher.cancel()
+        await outbox.close(timeout=shutdown.remaining())
+        await analytics.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
         await bot.session.close()
         await dp.storage.close()
-        await redis_client.aclose()
+        await redis_client.aclose(close_connection_pool=True)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,178 @@
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject
+from aiohttp import web
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+import redis.asyncio as async_redis
+
+
+UPDATE_LATENCY = Histogram('bot_update_latency_seconds', 'Full update processing time', ['update_type'])
+HANDLER_LATENCY = Histogram('bot_handler_latency_seconds', 'Handler execution time', ['handler'])
+REDIS_COMMAND_LATENCY = Histogram('bot_redis_command_latency_seconds', 'Redis command latency', ['command'])
+REDIS_COMMANDS_PER_UPDATE = Histogram('bot_redis_commands_per_update', 'Redis commands issued per update',
+                                      buckets=(0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 30))
+TELEGRAM_API_LATENCY = Histogram('bot_telegram_api_latency_seconds', 'Bot API request latency', ['method'])
+TELEGRAM_API_ERRORS = Counter('bot_telegram_api_errors', 'Failed Bot API requests', ['method', 'error'])
+QUIZ_FUNNEL = Counter('bot_quiz_funnel', 'Quiz funnel steps', ['step'])
+
+#  счётчик команд Redis текущего апдейта, список - чтобы его можно было менять из вложенных вызовов
+_redis_commands: ContextVar[Optional[list[int]]] = ContextVar('redis_commands', default=None)
+
+
+def _count_redis_commands(number: int) -> None:
+    commands = _redis_commands.get()
+    if commands is not None:
+        commands[0] += number
+
+
+class InstrumentedPipeline(async_redis.client.Pipeline):
+    """Пайплайн отправляет команды одним запросом, поэтому задержка пишется на весь
+    пайплайн, а в число команд апдейта идёт каждая команда из него"""
+
+    async def execute(self, raise_on_error: bool = True) -> list:
+        number = len(self.command_stack)
+        started = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            if number:
+                REDIS_COMMAND_LATENCY.labels('PIPELINE').observe(time.perf_counter() - started)
+                _count_redis_commands(number)
+
+
+class InstrumentedRedis(async_redis.Redis):
+
+    async def execute_command(self, *args: Any, **options: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            REDIS_COMMAND_LATENCY.labels(str(args[0]).upper()).observe(time.perf_counter() - started)
+            _count_redis_commands(1)
+
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> InstrumentedPipeline:
+        #  обычный Redis.pipeline() вернул бы Pipeline без учёта команд
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware апдейтов: общее время обработки и число команд Redis на апдейт"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+
+        commands = [0]
+        token = _redis_commands.set(commands)
+        started = time.perf_counter()
+
+        try:
+            return await handler(event, data)
+        finally:
+            UPDATE_LATENCY.labels(getattr(event, 'event_type', 'unknown')).observe(time.perf_counter() - started)
+            REDIS_COMMANDS_PER_UPDATE.observe(commands[0])
+            _redis_commands.reset(token)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            handler_name = data['handler'].callback.__name__
+            HANDLER_LATENCY.labels(handler_name).observe(time.perf_counter() - started)
+
+
+class TelegramMetricsRequestMiddleware(BaseRequestMiddleware):
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType]
+    ) -> Response[TelegramType]:
+
+        api_method = method.__api_method__
+        started = time.perf_counter()
+
+        try:
+            return await make_request(bot, method)
+        except Exception as err:
+            TELEGRAM_API_ERRORS.labels(api_method, type(err).__name__).inc()
+            raise
+        finally:
+            TELEGRAM_API_LATENCY.labels(api_method).observe(time.perf_counter() - started)
+
+
+class CountersCollector:
+    """Отдаёт в /metrics счётчики, которые компоненты бота ведут в обычном collections.Counter"""
+
+    def __init__(self, name: str, documentation: str, counters: Dict[str, int], label: str = 'kind'):
+        self.name = name
+        self.documentation = documentation
+        self.counters = counters
+        self.label = label
+
+    def collect(self):
+        metric = CounterMetricFamily(self.name, self.documentation, labels=[self.label])
+        for kind, value in self.counters.items():
+            metric.add_metric([kind], value)
+        yield metric
+
+
+def register_counters(name: str, documentation: str, counters: Dict[str, int]) -> None:
+    REGISTRY.register(CountersCollector(name, documentation, counters))
+
+
+class RedisPoolsCollector:
+    """Занятые, свободные и предельное число соединений пулов Redis"""
+
+    def __init__(self):
+        self.pools: Dict[str, async_redis.ConnectionPool] = {}
+
+    def collect(self):
+        metric = GaugeMetricFamily('bot_redis_pool_connections', 'Redis pool connections', labels=['pool', 'state'])
+        for name, pool in self.pools.items():
+            #  у пулов redis-py нет публичных счётчиков соединений
+            metric.add_metric([name, 'in_use'], len(pool._in_use_connections))
+            metric.add_metric([name, 'idle'], len(pool._available_connections))
+            metric.add_metric([name, 'max'], pool.max_connections)
+        yield metric
+
+
+REDIS_POOLS = RedisPoolsCollector()
+REGISTRY.register(REDIS_POOLS)
+
+
+def register_redis_pool(name: str, pool: async_redis.ConnectionPool) -> None:
+    REDIS_POOLS.pools[name] = pool
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(body=generate_latest(), headers={'Content-Type': CONTENT_TYPE_LATEST})
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -1,25 +1,119 @@
+import time
+from collections import Counter, OrderedDict
 from typing import Callable, Dict, Any, Awaitable
 from aiogram import BaseMiddleware
-from aiogram.types import TelegramObject, Message
+from aiogram.types import TelegramObject, User
 import redis.asyncio as async_redis
+from redis_batch import close_batch, defer_command, open_batch
 
 
-class ThrottlingMessagesMiddleware(BaseMiddleware):
+class ThrottlingMiddleware(BaseMiddleware):
 
-    def __init__(self, redis_client: async_redis.Redis, flood_wait_secs: int = 3):
+    def __init__(self,
+                 redis_client: async_redis.Redis,
+                 flood_wait_secs: float = 3,
+                 key_prefix: str = 'throttle:',
+                 local_cache_size: int = 10_000):
         self.redis_client = redis_client
         self.flood_wait_secs = flood_wait_secs
+        self.key_prefix = key_prefix
+        self.local_cache_size = local_cache_size
+        self.counters = Counter(allowed=0, throttled=0)
+        #  user_id -> время окончания окна, открытого этим процессом; повторы внутри окна
+        #  отсекаются без запроса к Redis
+        self._throttled_until: OrderedDict[int, float] = OrderedDict()
 
     async def __call__(
         self,
         handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
-        event: Message,
+        event: TelegramObject,
         data: Dict[str, Any]
     ) -> Any:
 
-        user_id_str = str(event.from_user.id)
-        user_throttling_data = await self.redis_client.get(user_id_str)
+        user: User = data.get('event_from_user')
 
-        if user_throttling_data is None:
-            await self.redis_client.set(user_id_str, 1, ex=self.flood_wait_secs)
+        if user is None:
             return await handler(event, data)
+
+        #  окно, открытое заранее, забирается здесь - значит, хендлер с троттлингом нашёлся
+        window = data.get('throttle_windows', {}).pop(self.key_prefix, None)
+        now = time.monotonic()
+
+        if self._is_locally_throttled(user.id, now):
+            self.counters['throttled'] += 1
+            return
+
+        if window is not None and window.done() and not window.cancelled():
+            is_allowed = window.result()
+        else:
+            is_allowed = await self.redis_client.set(self._build_key(user.id), 1,
+                                                     px=int(self.flood_wait_secs * 1000), nx=True)
+
+        if not is_allowed:
+            self.counters['throttled'] += 1
+            return
+
+        self._throttled_until[user.id] = now + self.flood_wait_secs
+        self._throttled_until.move_to_end(user.id)
+        if len(self._throttled_until) > self.local_cache_size:
+            self._throttled_until.popitem(last=False)
+
+        self.counters['allowed'] += 1
+        return await handler(event, data)
+
+    def _build_key(self, user_id: int) -> str:
+        return f'{self.key_prefix}{user_id}'
+
+    def _is_locally_throttled(self, user_id: int, now: float) -> bool:
+        throttled_until = self._throttled_until.get(user_id)
+        return throttled_until is not None and throttled_until > now
+
+    def prefetch(self, user_id: int, data: Dict[str, Any]) -> None:
+        """Откладывает открытие окна до чтения состояния FSM, результат ляжет в data"""
+
+        if self._is_locally_throttled(user_id, time.monotonic()):
+            return
+
+        window = defer_command(lambda pipe: pipe.set(self._build_key(user_id), 1,
+                                                     px=int(self.flood_wait_secs * 1000), nx=True))
+        if window is not None:
+            data.setdefault('throttle_windows', {})[self.key_prefix] = window
+
+    async def release_unused(self, user_id: int, data: Dict[str, Any]) -> None:
+        """Закрывает окно, открытое prefetch, если ни один хендлер с троттлингом не сработал:
+        иначе сообщение без хендлера отсекло бы следующую за ним команду"""
+
+        window = data.get('throttle_windows', {}).pop(self.key_prefix, None)
+        if window is not None and window.done() and not window.cancelled() and window.result():
+            await self.redis_client.delete(self._build_key(user_id))
+
+
+class RedisBatchMiddleware(BaseMiddleware):
+    """Внешний middleware апдейтов перед FSMContextMiddleware: окно троттлинга апдейта
+    уходит в Redis одним пайплайном с чтением состояния FSM (см. BatchingRedisStorage).
+    Имеет смысл, только когда кэш и FSM живут в одном пуле"""
+
+    def __init__(self, throttling: Dict[str, ThrottlingMiddleware]):
+        #  тип события апдейта -> троттлинг, навешанный на этот тип
+        self.throttling = throttling
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+
+        user: User = data.get('event_from_user')
+        throttling = self.throttling.get(getattr(event, 'event_type', None))
+
+        if user is None or throttling is None:
+            return await handler(event, data)
+
+        token = open_batch()
+        try:
+            throttling.prefetch(user.id, data)
+            return await handler(event, data)
+        finally:
+            close_batch(token)
+            await throttling.release_unused(user.id, data)
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+
+logger = logging.getLogger()
+
+OutboxCall = Callable[[], Awaitable[object]]
+
+
+class Outbox:
+    """Очередь исходящих запросов к Telegram.
+
+    Запросы одного чата выполняются по порядку, с паузой delay после предыдущего, если
+    она задана. Хендлер только ставит запрос в очередь и сразу освобождается. Лимиты
+    Telegram на чаты и на бота целиком здесь не соблюдаются - это дело RateLimitRequestMiddleware
+    сессии бота, который видит и запросы, отправленные хендлерами напрямую.
+    """
+
+    def __init__(self):
+        self._queues: dict[int, deque[tuple[OutboxCall, float]]] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def submit(self, chat_id: int, call: OutboxCall, delay: float = 0) -> None:
+        """delay - минимальная пауза после предыдущего запроса в этот же чат"""
+
+        queue = self._queues.get(chat_id)
+
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+            task = asyncio.create_task(self._process_chat(chat_id, queue))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        queue.append((call, delay))
+
+    async def _process_chat(self, chat_id: int, queue: deque[tuple[OutboxCall, float]]) -> None:
+        loop = asyncio.get_running_loop()
+        last_call_time = None
+
+        try:
+            while queue:
+                call, delay = queue.popleft()
+
+                if last_call_time is not None and delay:
+                    wait = last_call_time + delay - loop.time()
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+
+                try:
+                    await call()
+                except Exception as err:
+                    logger.critical('Outbox call for chat %s failed: %s', chat_id, err, exc_info=True)
+
+                last_call_time = loop.time()
+        finally:
+            del self._queues[chat_id]
+
+    async def close(self, timeout: Optional[float] = None) -> None:
+        """Дожидается отправки накопленных запросов, не дольше timeout секунд"""
+
+        if self._tasks:
+            _, pending = await asyncio.wait(tuple(self._tasks), timeout=timeout)
+            for task in pending:
+                task.cancel()
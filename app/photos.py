@@ -0,0 +1,61 @@
+import asyncio
+from collections import defaultdict
+from typing import Any
+from aiogram import Bot
+from aiogram.types import FSInputFile, Message
+import redis.asyncio as async_redis
+
+
+class PhotoCache:
+    """file_id загруженных в Telegram картинок: словарь в памяти процесса поверх Redis.
+
+    Каждая картинка загружается не больше одного раза на процесс: параллельные отправки
+    одной и той же картинки ждут первую загрузку и получают её file_id.
+    """
+
+    def __init__(self, redis_client: async_redis.Redis, key_prefix: str = 'photo:'):
+        self.redis_client = redis_client
+        self.key_prefix = key_prefix
+        self._file_ids: dict[str, str] = {}
+        self._locks: defaultdict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    async def load(self, names) -> None:
+        names = tuple(names)
+        file_ids = await self.redis_client.mget([self.key_prefix + name for name in names])
+        self._file_ids.update((name, file_id.decode()) for name, file_id in zip(names, file_ids) if file_id is not None)
+
+    async def _upload(self, bot: Bot, chat_id: int, name: str, image_path: str, **kwargs: Any) -> Message:
+        sent_message = await bot.send_photo(chat_id=chat_id, photo=FSInputFile(image_path), **kwargs)
+        widest_photo_id = max(sent_message.photo, key=lambda f: f.width).file_id
+        await self.redis_client.set(self.key_prefix + name, widest_photo_id)
+        self._file_ids[name] = widest_photo_id
+        return sent_message
+
+    async def send_photo(self, bot: Bot, chat_id: int, name: str, image_path: str, **kwargs: Any) -> Message:
+        file_id = self._file_ids.get(name)
+
+        if file_id is None:
+            async with self._locks[name]:
+                file_id = self._file_ids.get(name)
+
+                if file_id is None:
+                    await self.load((name, ))
+                    file_id = self._file_ids.get(name)
+
+                if file_id is None:
+                    # Отправка файла из файловой системы
+                    return await self._upload(bot, chat_id, name, image_path, **kwargs)
+
+        return await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+
+    async def warm_up(self, bot: Bot, chat_id: int, images: dict[str, str]) -> None:
+        """Загружает в служебный чат картинки, которых ещё нет в кэше"""
+
+        await self.load(images)
+
+        for name, image_path in images.items():
+            if name not in self._file_ids:
+                async with self._locks[name]:
+                    #  прогрев идёт в фоне, и send_photo мог загрузить картинку, пока ждали блокировку
+                    if name not in self._file_ids:
+                        await self._upload(bot, chat_id, name, image_path)
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+from typing import Iterable, Optional
+from aiogram import Bot, Dispatcher
+from aiogram.methods import GetUpdates
+from aiogram.types import Update
+from aiogram.utils.backoff import Backoff, BackoffConfig
+import redis.asyncio as async_redis
+from shutdown import Shutdown
+
+
+logger = logging.getLogger()
+
+
+class UpdateOffsetStore:
+    """offset следующего апдейта и журнал полученных, но ещё не доделанных апдейтов.
+
+    Telegram забывает апдейты, как только их подтверждает offset следующего getUpdates,
+    поэтому до этого они записываются в журнал - хэш update_id -> JSON апдейта.
+    """
+
+    def __init__(self, redis_client: async_redis.Redis, key: str):
+        self.redis_client = redis_client
+        self.key = key
+        self.pending_key = f'{key}:pending'
+
+    async def load(self) -> Optional[int]:
+        offset = await self.redis_client.get(self.key)
+        return int(offset) if offset is not None else None
+
+    async def load_pending(self) -> list[bytes]:
+        pending = await self.redis_client.hgetall(self.pending_key)
+        return [pending[update_id] for update_id in sorted(pending, key=int)]
+
+    async def record(self, updates: list[Update], next_offset: int) -> None:
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.hset(self.pending_key, mapping={update.update_id: update.model_dump_json(exclude_unset=True)
+                                                 for update in updates})
+            pipe.set(self.key, next_offset)
+            await pipe.execute()
+
+    async def complete(self, update_ids: Iterable[int]) -> None:
+        await self.redis_client.hdel(self.pending_key, *update_ids)
+
+
+async def run_polling(dp: Dispatcher,
+                      bot: Bot,
+                      offset_store: UpdateOffsetStore,
+                      shutdown: Shutdown,
+                      polling_timeout: int = 10,
+                      max_concurrency: int = 100,
+                      save_interval: float = 1.0) -> None:
+    """Long polling, который переживает перезапуск и падение без потерь.
+
+    Полученные апдейты попадают в журнал до следующего getUpdates, который подтвердит их
+    у Telegram, а доделанные вычёркиваются из журнала пачкой раз в save_interval секунд.
+    Поллинг не ждёт медленные хендлеры: апдейты других чатов идут дальше.
+    По сигналу остановки новые апдейты больше не запрашиваются, начатые доделываются
+    до срока shutdown. После перезапуска недоделанные апдейты из журнала обрабатываются
+    первыми; доделанные за последние save_interval секунд перед падением придут повторно.
+    """
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+    tasks: set[asyncio.Task] = set()
+    finished: list[int] = []
+    next_offset = await offset_store.load()
+
+    async def process_update(update: Update) -> None:
+        try:
+            try:
+                await dp.feed_update(bot, update)
+            except Exception as err:
+                logger.error('Update %s failed: %s', update.update_id, err, exc_info=True)
+            #  отменённый по сроку остановки апдейт остаётся в журнале
+            finished.append(update.update_id)
+        finally:
+            semaphore.release()
+
+    async def dispatch(updates: list[Update]) -> bool:
+        """Запускает обработку апдейтов, False - если раньше пришёл сигнал остановки"""
+
+        for update in updates:
+            await semaphore.acquire()
+            if shutdown.is_requested:
+                semaphore.release()
+                return False
+            task = asyncio.create_task(process_update(update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        return True
+
+    async def save_finished() -> None:
+        if finished:
+            update_ids = finished[:]
+            await offset_store.complete(update_ids)
+            del finished[:len(update_ids)]
+
+    async def save_finished_periodically() -> None:
+        while True:
+            await asyncio.sleep(save_interval)
+            try:
+                await save_finished()
+            except Exception as err:
+                logger.error('Saving finished updates failed: %s', err)
+
+    #  апдейты, не доделанные до остановки или падения прошлого процесса
+    pending = [Update.model_validate_json(raw_update, context={'bot': bot})
+               for raw_update in await offset_store.load_pending()]
+    if pending:
+        logger.warning('Replaying %s updates left unfinished by the previous run', len(pending))
+
+    #  вебхук и поллинг взаимоисключающие; накопившиеся апдейты не сбрасываются
+    await bot.delete_webhook(drop_pending_updates=False)
+
+    allowed_updates = dp.resolve_used_update_types()
+    request_timeout = int(bot.session.timeout + polling_timeout) if bot.session.timeout else None
+    backoff = Backoff(config=BackoffConfig(min_delay=1.0, max_delay=30.0, factor=1.5, jitter=0.1))
+    shutdown_waiter = asyncio.create_task(shutdown.wait())
+    finished_saver = asyncio.create_task(save_finished_periodically())
+
+    try:
+        running = await dispatch(pending)
+
+        while running and not shutdown.is_requested:
+            get_updates = asyncio.create_task(bot(GetUpdates(offset=next_offset,
+                                                             timeout=polling_timeout,
+                                                             allowed_updates=allowed_updates),
+                                                  request_timeout=request_timeout))
+            await asyncio.wait((get_updates, shutdown_waiter), return_when=asyncio.FIRST_COMPLETED)
+
+            if not get_updates.done():
+                #  полученные этим запросом апдейты не подтверждены и придут после перезапуска
+                get_updates.cancel()
+                break
+
+            try:
+                updates = get_updates.result()
+                if updates:
+                    #  без записи в журнал offset не сдвигается, и Telegram отдаст те же апдейты снова
+                    await offset_store.record(updates, updates[-1].update_id + 1)
+            except Exception as err:
+                logger.error('Failed to fetch updates: %s', err)
+                await shutdown.sleep(next(backoff))
+                continue
+            backoff.reset()
+
+            if updates:
+                next_offset = updates[-1].update_id + 1
+                running = await dispatch(updates)
+    finally:
+        shutdown_waiter.cancel()
+        finished_saver.cancel()
+        await shutdown.drain(tasks)
+        await save_finished()
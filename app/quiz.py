@@ -1,126 +1,230 @@
-from os import path
+import asyncio
+import hashlib
+import json
+import logging
+import signal
+from dataclasses import dataclass
+from os import listdir, path
+from types import MappingProxyType
+from typing import Callable, Mapping, Optional
+from aiogram import html, types
+from aiogram.types import InlineKeyboardMarkup
+from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 
-PSYCHOTYPES_IMG_FOLDER = 'images'
+logger = logging.getLogger()
 
-PSYCHOTYPES = {'kinesthetic': {'rus': 'кинестетик',
-                               'image': path.join(PSYCHOTYPES_IMG_FOLDER, 'kinesthetic.png'),
-                               'garden': '«Сад объятий»',
-                               'description': '. В нем вам комфортно и приятно находиться. Здесь можно пройтись '
-                                              'босиком по теплому дереву террасной доски, согретому на солнце '
-                                              'природному камню или мягкой свежескошенной траве.\n\n'
-                                              'Идя мимо растительных композиций, можно ощущать руками касания колосков '
-                                              'злаков или прикоснуться к хвойным растениям. '
-                                              'Можно собрать букет из свежесрезанных многолетних цветов '
-                                              'и поставить их в вазу. Мягкая мебель на террасе не позволит пройти мимо, '
-                                              'так и хочется присесть и полюбоваться на красоту пейзажа вокруг. '
-                                              'Подушки, плед создают дополнительный уют. '
-                                              'Свечи и элементы  декора создадут душевную атмосферу в вашем саду.'},
+QUIZZES_FOLDER = path.join(path.dirname(path.abspath(__file__)), 'quizzes')
+DEFAULT_QUIZ_ID = 'garden'
+#  история ответов сессии хранит индекс психотипа в одном байте
+MAX_PSYCHOTYPES = 256
 
-               'visual': {'rus': 'визуал',
-                          'image': path.join(PSYCHOTYPES_IMG_FOLDER, 'visual.png'),
-                          'garden': '«Сад искусств»',
-                          'description': ', где есть яркие акценты, живые картины, '
-                                         'нарисованные словно самой природой. Акцентные цвета растений, '
-                                         'формы и текстуры листьев создают непередаваемые эмоции, которые радуют глаз. '
-                                         'Сад – это место созерцания изящных изгибов дорожек, нависающих деревьев, '
-                                         'изучения сложных деталей и фактур всех материалов. '
-                                         'Силуэты деревьев, очертания лужаек и цветников, дополняют друг друга, '
-                                         'образуя гармоничную садовую композицию. Так и хочется сделать фотографию '
-                                         'или нарисовать картину вашего пейзажа.'},
+NUMS_EMOJI = dict(zip(tuple(range(10)), ('0️⃣', '1️⃣', '2️⃣', '3️⃣', '4️⃣', '5️⃣', '6️⃣', '7️⃣', '8️⃣', '9️⃣')))
 
-               'audial': {'rus': 'аудиал',
-                          'image': path.join(PSYCHOTYPES_IMG_FOLDER, 'audial.png'),
-                          'garden': '«Сад чувств»',
-                          'description': ', который состоит из множества тихих уголков и зеленых комнат. '
-                                         'Здесь вы сможете насладиться тишиной и покоем, '
-                                         'прогуляться по плавным дорожкам, послушать шелест листвы на деревьях, '
-                                         'насладиться пением птиц и понаблюдать за колыханием злаков. '
-                                         'Многолетние растения в цветниках наполнят воздух приятной успокаивающей '
-                                         'летней мелодией и создадут атмосферу свежести и умиротворения, '
-                                         'помогут отвлечься от городской суеты и шума.'}}
 
-PSYCHOTYPES_NAMES = tuple(PSYCHOTYPES.keys())
+@dataclass(frozen=True)
+class CompiledQuiz:
+    """Квиз, готовый к показу: тексты вопросов и клавиатуры отрисованы заранее.
 
-KINESTHETIC, VISUAL, AUDIAL = PSYCHOTYPES_NAMES
+    Кнопка ответа передаёт в callback_data индекс психотипа в psychotypes_names.
+    Тексты с переменными полями хранятся кусками между ними (см. split_template),
+    по психотипам индексируются так же, как psychotypes_names.
+    """
 
-QUIZ = (('За что вы цените жизнь за городом?',
+    quiz_id: str
+    version: int
+    psychotypes_names: tuple[str, ...]
+    psychotypes: Mapping[str, Mapping[str, str]]
+    questions: tuple[tuple[str, InlineKeyboardMarkup], ...]
+    texts: Mapping[str, str]
+    start_parts: tuple[str, ...]
+    result_parts: tuple[tuple[str, ...], ...]
+    score_line_parts: tuple[tuple[str, ...], ...]
+    p_s_parts: tuple[str, ...]
+
+    @property
+    def length(self) -> int:
+        return len(self.questions)
+
+    @property
+    def images(self) -> dict[str, str]:
+        """Хэш содержимого картинки -> путь к ней, хэш служит ключом кэша file_id"""
+
+        return {psychotype['image_hash']: psychotype['image'] for psychotype in self.psychotypes.values()}
+
+    def get_question(self, position: int) -> tuple[str, InlineKeyboardMarkup]:
+        try:
+            return self.questions[position]
+        except IndexError:
+            return self.questions[0]
+
+    def render_start(self, first_name: str) -> str:
+        return html.quote(first_name).join(self.start_parts)
+
+    def render_result(self, psychotype_index: int, scores: tuple[int, ...]) -> str:
+        """Подпись к картинке результата: баллы по убыванию, при равенстве - в порядке психотипов"""
+
+        ranked = sorted(range(len(scores)), key=scores.__getitem__, reverse=True)
+        scored_psychotypes = '\n'.join(str((scores[index] * 100) // self.length).join(self.score_line_parts[index])
+                                       for index in ranked)
+        return scored_psychotypes.join(self.result_parts[psychotype_index])
+
+    def render_p_s(self, first_name: str) -> str:
+        return html.quote(first_name).join(self.p_s_parts)
+
+
+def split_template(template: str, field: str, **values: str) -> tuple[str, ...]:
+    """Подставляет в шаблон постоянные поля и режет его по переменному field:
+    потом остаётся только склеить куски значением поля, field.join(parts)"""
+
+    return tuple(template.format(**values, **{field: '\0'}).split('\0'))
+
+
+def render_question(position: int, questions_count: int, question: str, answers: dict[str, str],
+                    psychotypes_names: tuple[str, ...], hint: str) -> tuple[str, InlineKeyboardMarkup]:
+    question_num = html.italic(f'Вопрос {position + 1}/{questions_count}')
+    formatted_question = f'{question_num}\n\n{html.bold(question)}\n\n'
+
+    inline_keyboard = InlineKeyboardBuilder()
+
+    for index_, (role, answer) in enumerate(answers.items(), start=1):
+        formatted_question += f'{NUMS_EMOJI[index_]} {answer}\n'
+        inline_keyboard.add(types.InlineKeyboardButton(text=NUMS_EMOJI[index_],
+                                                       callback_data=str(psychotypes_names.index(role))))
+
+    formatted_question += f'\n{hint}'
+
+    return formatted_question, inline_keyboard.as_markup()
+
+
+def image_hash(image_path: str) -> str:
+    with open(image_path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def compile_quiz(raw_quiz: dict, base_folder: str) -> CompiledQuiz:
+    psychotypes_names = tuple(raw_quiz['psychotypes'])
+    if len(psychotypes_names) > MAX_PSYCHOTYPES:
+        raise ValueError(f'Quiz {raw_quiz["id"]!r} has {len(psychotypes_names)} psychotypes, '
+                         f'at most {MAX_PSYCHOTYPES} are supported')
+    texts = raw_quiz['texts']
+    questions = raw_quiz['questions']
 
-         {KINESTHETIC: 'Большая территория для игры с детьми и животными, много разных зон, большая парковка',
-          AUDIAL: 'Хочется больше природы и не слышать соседей',
-          VISUAL: 'Возможность создать красивый сад с разными зонами отдыха, цветниками и деревьями'}),
+    psychotypes = {}
+    for name, psychotype in raw_quiz['psychotypes'].items():
+        psychotype = dict(psychotype)
+        psychotype['image'] = path.normpath(path.join(base_folder, psychotype['image']))
+        #  новая версия квиза с теми же картинками не загружает их в Telegram заново,
+        #  а подменённый файл загружается, даже если путь к нему не изменился
+        psychotype['image_hash'] = image_hash(psychotype['image'])
+        psychotypes[name] = MappingProxyType(psychotype)
 
-
-        ('Какие материалы для дорожек вы предпочитаете?',
-
-         {AUDIAL: 'Натуральные каменные плиты, отсев, каменная крошка',
-          KINESTHETIC: 'Тротуарная плитка, декинг',
-          VISUAL: 'Клинкерный кирпич, природный камень'}),
-
-
-        ('Выберите группу растений, которые вам нравятся больше остальных?',
-
-         {VISUAL: 'Клен, бересклет, магнолия, рябина, сосна ниваки, багряник, спирея, пузыреплодник',
-          AUDIAL: 'Ива, осина, береза, вейник, молиния, осока, мискантус',
-          KINESTHETIC: 'Сирень, роза ругоза, чубушник, гортензия, черемуха, мелисса, вербена'}),
-
-
-        ('В какой зоне сада вы предпочтете провести свой вечер?',
-
-         {KINESTHETIC: 'В зоне барбекю или летней кухни',
-          AUDIAL: 'В большой компании на патио под свет гирлянд и фонарей',
-          VISUAL: 'Костровая зона в компании 2-4 человек'}),
-
-
-        ('Какую планировку сада вы выберите?',
-
-         {AUDIAL: 'Плавные природные линии, места отдыха с водными объектами, тихие зоны для бесед с друзьями',
-          VISUAL: 'Различные места отдыха с эффектными видовыми точками и живописным окрестным пейзажем',
-          KINESTHETIC: 'Уютные зеленые комнаты, внутренний дворик, веранда, беседка, многочисленные островки отдыха'}),
-
-
-        ('Опишите ваше утро',
-
-         {KINESTHETIC: 'Пью кофе сидя на мягком диване. '
-                       'Сад наполнен ароматом аппетитных яблок, меня окружают растения необычных форм и фактур',
-          VISUAL: 'Прогуливаюсь по саду, любуясь яркими утренними цветами, росой на траве. '
-                  'Лужайка ровная, обрамленная извилистыми дорожками идеально вписанными в ландшафт',
-          AUDIAL: 'Сижу на террасе, слушаю пение птиц, играет приятная музыка'}),
-
-
-        ('Как бы вы провели 2 часа свободного времени в саду?',
-
-         {AUDIAL: 'Полежу в шезлонге в тени деревьев, послушаю шелест листвы и звуки природы',
-          VISUAL: 'Проведу осмотр участка на предмет сорняков и разросшихся растений и приведу его в порядок',
-          KINESTHETIC: 'Присмотрю в интернет-магазине декор для своего участка или смастерю его самостоятельно'}),
-
-
-        ('Какую часть дня вы любите проводить в саду?',
-
-         {KINESTHETIC: 'Днем',
-          VISUAL: 'Вечером',
-          AUDIAL: 'Утро'}),
-
-
-        ('Как часто вы приглашаете друзей и большие компании?',
-
-         {AUDIAL: 'Каждую неделю и чаще',
-          KINESTHETIC: 'Редко, может раз в несколько месяцев',
-          VISUAL: 'Пару раз в месяц'}),
-
-
-        ('Какие ощущения вы хотите испытывать чаще в своем саду?',
-
-         {VISUAL: 'Чувствуете себя свободно, наполняюсь энергией и силой',
-          AUDIAL: 'Вам умиротворенно, легко, в полной безопасности – это мой мир',
-          KINESTHETIC: 'Вам уютно, спокойно, комфортно'}))
-
-
-QUIZ_LEN = len(QUIZ)
-
-
-def get_question_by_position(position: int) -> tuple[str, dict]:
-    try:
-        return QUIZ[position]
-    except IndexError:
-        return QUIZ[0]
+    rendered_questions = tuple(render_question(position, len(questions), question['text'], question['answers'],
+                                               psychotypes_names, texts['question_hint'])
+                               for position, question in enumerate(questions))
+
+    result_parts = tuple(split_template(texts['result'], 'scores',
+                                        garden=psychotype['garden'], description=psychotype['description'])
+                         for psychotype in psychotypes.values())
+    score_line_parts = tuple(split_template(texts['score_line'], 'percent', garden=psychotype['garden'].title())
+                             for psychotype in psychotypes.values())
+
+    return CompiledQuiz(quiz_id=raw_quiz['id'],
+                        version=int(raw_quiz['version']),
+                        psychotypes_names=psychotypes_names,
+                        psychotypes=MappingProxyType(psychotypes),
+                        questions=rendered_questions,
+                        texts=MappingProxyType(dict(texts)),
+                        start_parts=split_template(texts['start'], 'name'),
+                        result_parts=result_parts,
+                        score_line_parts=score_line_parts,
+                        p_s_parts=split_template(texts['ps'], 'name'))
+
+
+def load_quiz_file(file_path: str) -> CompiledQuiz:
+    with open(file_path, encoding='utf-8') as file:
+        if file_path.endswith(('.yaml', '.yml')):
+            import yaml
+            raw_quiz = yaml.safe_load(file)
+        else:
+            raw_quiz = json.load(file)
+
+    #  пути к картинкам в файле квиза - относительно самого файла
+    return compile_quiz(raw_quiz, path.dirname(path.abspath(file_path)))
+
+
+class QuizRegistry:
+    """Все загруженные версии квизов. Перезагрузка собирает новый словарь и подменяет его
+    целиком, старые версии остаются, чтобы начатые на них сессии можно было доиграть."""
+
+    def __init__(self, folder: str = QUIZZES_FOLDER, default_quiz_id: str = DEFAULT_QUIZ_ID):
+        self.folder = folder
+        self.default_quiz_id = default_quiz_id
+        self._quizzes: dict[tuple[str, int], CompiledQuiz] = {}
+        self._current: dict[str, CompiledQuiz] = {}
+        self._mtimes: dict[str, float] = {}
+        self._reload_callbacks: list[Callable[[], None]] = []
+
+    def _scan(self) -> dict[str, float]:
+        return {file_name: path.getmtime(path.join(self.folder, file_name))
+                for file_name in listdir(self.folder)
+                if file_name.endswith(('.json', '.yaml', '.yml'))}
+
+    def load(self) -> None:
+        mtimes = self._scan()
+        quizzes = dict(self._quizzes)
+
+        for file_name in mtimes:
+            quiz = load_quiz_file(path.join(self.folder, file_name))
+            quizzes[quiz.quiz_id, quiz.version] = quiz
+
+        current = {}
+        for quiz in quizzes.values():
+            if quiz.quiz_id not in current or current[quiz.quiz_id].version < quiz.version:
+                current[quiz.quiz_id] = quiz
+
+        if self.default_quiz_id not in current:
+            raise LookupError(f'Default quiz {self.default_quiz_id!r} not found in {self.folder}')
+
+        self._quizzes, self._current, self._mtimes = quizzes, current, mtimes
+
+    def add_reload_callback(self, callback: Callable[[], None]) -> None:
+        """callback вызывается после каждой успешной перезагрузки квизов"""
+
+        self._reload_callbacks.append(callback)
+
+    def reload(self) -> None:
+        try:
+            self.load()
+        except Exception as err:
+            logger.error('Quizzes reload failed, keeping loaded versions: %s', err, exc_info=True)
+            return
+
+        for callback in self._reload_callbacks:
+            try:
+                callback()
+            except Exception as err:
+                logger.error('Quizzes reload callback failed: %s', err, exc_info=True)
+
+    def current(self, quiz_id: Optional[str] = None) -> CompiledQuiz:
+        return self._current.get(quiz_id or self.default_quiz_id) or self._current[self.default_quiz_id]
+
+    def get(self, quiz_id: str, version: int) -> CompiledQuiz:
+        return self._quizzes.get((quiz_id, version)) or self.current(quiz_id)
+
+    def __iter__(self):
+        return iter(tuple(self._current.values()))
+
+    def install_sighup_handler(self) -> None:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, self.reload)
+
+    async def watch(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                changed = self._scan() != self._mtimes
+            except OSError as err:
+                logger.error('Quizzes folder scan failed: %s', err)
+                continue
+            if changed:
+                self.reload()
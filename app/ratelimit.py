@@ -0,0 +1,169 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import Counter
+from typing import Optional
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+
+#  чем меньше число, тем раньше запрос получит квоту
+INTERACTIVE_PRIORITY = 0
+SEND_PRIORITY = 1
+CLEANUP_PRIORITY = 2
+
+METHODS_PRIORITY = {'editMessageText': INTERACTIVE_PRIORITY,
+                    'editMessageReplyMarkup': INTERACTIVE_PRIORITY,
+                    'deleteMessage': CLEANUP_PRIORITY}
+
+#  запросы, которые Telegram считает сообщениями в чат и ограничивает по каждому чату
+CHAT_LIMITED_METHODS_PREFIXES = ('send', 'edit', 'copy', 'forward')
+
+#  общий лимит в ~30 запросов в секунду у Telegram касается только сообщений, поэтому ответы
+#  на нажатия кнопок, getUpdates и прочие служебные запросы квоту не тратят и не ждут её
+GLOBALLY_LIMITED_METHODS = ('deleteMessage', )
+
+
+class TokenBucket:
+    """Ведро токенов: ждущие квоту запросы обслуживаются в порядке приоритета"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._serve_task: Optional[asyncio.Task] = None
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    @property
+    def idle(self) -> bool:
+        self._refill(time.monotonic())
+        return not self._waiters and self.tokens >= self.capacity
+
+    def pause(self, seconds: float) -> None:
+        """Запрещает запросы на seconds секунд, например после ответа 429"""
+
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+    async def acquire(self, priority: int = SEND_PRIORITY) -> bool:
+        """Ждёт токен, возвращает True, если запросу пришлось ждать"""
+
+        self._refill(time.monotonic())
+
+        if not self._waiters and self.tokens >= 1:
+            self.tokens -= 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), waiter))
+
+        if self._serve_task is None:
+            self._serve_task = asyncio.create_task(self._serve())
+
+        await waiter
+        return True
+
+    async def _serve(self) -> None:
+        try:
+            while self._waiters:
+                self._refill(time.monotonic())
+
+                if self.tokens < 1:
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+                    continue
+
+                *_, waiter = heapq.heappop(self._waiters)
+                if not waiter.done():
+                    self.tokens -= 1
+                    waiter.set_result(None)
+        finally:
+            self._serve_task = None
+
+
+class RateLimitRequestMiddleware(BaseRequestMiddleware):
+    """Общий бюджет запросов к Bot API: глобальный лимит, лимиты на чаты и группы, повтор после 429"""
+
+    def __init__(self,
+                 global_rate: float = 30,
+                 private_chat_rate: float = 1,
+                 group_chat_rate: float = 20 / 60,
+                 chat_burst: int = 3,
+                 max_retries: int = 3,
+                 max_retry_after: int = 30,
+                 max_chat_buckets: int = 10_000):
+        self.global_rate = global_rate
+        self.private_chat_rate = private_chat_rate
+        self.group_chat_rate = group_chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self.max_chat_buckets = max_chat_buckets
+        self.counters = Counter(queued=0, delayed=0, dropped=0)
+        self.global_bucket = TokenBucket(global_rate)
+        self._chat_buckets: dict[int, TokenBucket] = {}
+
+    def get_chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+
+        if bucket is None:
+            if len(self._chat_buckets) >= self.max_chat_buckets:
+                self._chat_buckets = {chat: chat_bucket for chat, chat_bucket in self._chat_buckets.items()
+                                      if not chat_bucket.idle}
+
+            #  у групп и каналов отрицательные id
+            rate = self.private_chat_rate if chat_id > 0 else self.group_chat_rate
+            bucket = self._chat_buckets[chat_id] = TokenBucket(rate, capacity=self.chat_burst)
+
+        return bucket
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType]
+    ) -> Response[TelegramType]:
+
+        api_method = method.__api_method__
+        priority = METHODS_PRIORITY.get(api_method, SEND_PRIORITY)
+        chat_id = getattr(method, 'chat_id', None)
+
+        chat_limited = api_method.startswith(CHAT_LIMITED_METHODS_PREFIXES)
+        globally_limited = chat_limited or api_method in GLOBALLY_LIMITED_METHODS
+
+        chat_bucket = None
+        if isinstance(chat_id, int) and chat_limited:
+            chat_bucket = self.get_chat_bucket(chat_id)
+
+        self.counters['queued'] += 1
+
+        for attempt in range(self.max_retries + 1):
+            delayed = chat_bucket is not None and await chat_bucket.acquire(priority)
+            if globally_limited:
+                delayed = await self.global_bucket.acquire(priority) or delayed
+
+            if delayed:
+                self.counters['delayed'] += 1
+
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as err:
+                if attempt == self.max_retries or err.retry_after > self.max_retry_after:
+                    self.counters['dropped'] += 1
+                    raise
+
+                if chat_bucket is not None:
+                    chat_bucket.pause(err.retry_after)
+                elif globally_limited:
+                    self.global_bucket.pause(err.retry_after)
+                else:
+                    await asyncio.sleep(err.retry_after)
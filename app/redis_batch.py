@@ -0,0 +1,66 @@
+import asyncio
+from contextvars import ContextVar
+from typing import Any, Callable, Optional
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.redis import RedisStorage
+from redis.asyncio.client import Pipeline
+
+
+#  команды апдейта, которые уйдут в Redis вместе с чтением состояния FSM одним пайплайном
+_deferred_commands: ContextVar[Optional[list[tuple[Callable[[Pipeline], Any], asyncio.Future]]]] = \
+    ContextVar('deferred_commands', default=None)
+
+
+def open_batch() -> object:
+    return _deferred_commands.set([])
+
+
+def close_batch(token) -> None:
+    #  команды, которые так и не ушли, отменяются - их владельцы выполнят их сами
+    for _, future in _deferred_commands.get() or ():
+        future.cancel()
+    _deferred_commands.reset(token)
+
+
+def defer_command(command: Callable[[Pipeline], Any]) -> Optional[asyncio.Future]:
+    """Откладывает команду до чтения состояния FSM, без открытого пакета возвращает None"""
+
+    deferred = _deferred_commands.get()
+    if deferred is None:
+        return None
+
+    future = asyncio.get_running_loop().create_future()
+    deferred.append((command, future))
+    return future
+
+
+class BatchingRedisStorage(RedisStorage):
+    """Читает состояние FSM в одном пайплайне с отложенными командами апдейта.
+
+    Состояние читается под блокировкой events isolation, поэтому оно не устаревает,
+    а команды (окно троттлинга) не требуют лишнего похода в Redis.
+    """
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        deferred = _deferred_commands.get()
+        if not deferred:
+            return await super().get_state(key)
+
+        commands = deferred[:]
+        deferred.clear()
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.get(self.key_builder.build(key, 'state'))
+            for command, _ in commands:
+                command(pipe)
+            try:
+                value, *results = await pipe.execute()
+            except BaseException:
+                for _, future in commands:
+                    future.cancel()
+                raise
+
+        for (_, future), result in zip(commands, results):
+            future.set_result(result)
+
+        return value.decode('utf-8') if isinstance(value, bytes) else value
@@ -1,5 +1,22 @@
-import redis.asyncio as redis
+from functools import lru_cache
 from os import getenv
+from redis.asyncio import BlockingConnectionPool
+from metrics import InstrumentedRedis, register_redis_pool
+
+
+def create_redis_client(dsn: str, name: str) -> InstrumentedRedis:
+    """Клиент с ограниченным пулом: при сбое Redis запросы ждут свободное соединение
+    не дольше REDIS_POOL_TIMEOUT секунд, а не открывают новые без счёта"""
+
+    pool = BlockingConnectionPool.from_url(dsn,
+                                           max_connections=int(getenv('REDIS_MAX_CONNECTIONS', 50)),
+                                           timeout=float(getenv('REDIS_POOL_TIMEOUT', 5)),
+                                           socket_timeout=float(getenv('REDIS_SOCKET_TIMEOUT', 5)),
+                                           socket_connect_timeout=float(getenv('REDIS_CONNECT_TIMEOUT', 2)),
+                                           socket_keepalive=True,
+                                           health_check_interval=int(getenv('REDIS_HEALTH_CHECK_INTERVAL', 30)))
+    register_redis_pool(name, pool)
+    return InstrumentedRedis(connection_pool=pool)
 
 
 # redis_cache = Redis(host=getenv('REDIS_CACHE_HOST'),
@@ -7,4 +24,25 @@ from os import getenv
 #                     db=int(getenv('REDIS_CACHE_DB')),
 #                     decode_responses=True)
 
-redis_client = redis.Redis.from_url(getenv('REDIS_CACHE_DSN'), decode_responses=True)
+#  клиенты создаются при первом обращении, а не при импорте: модули бота импортируются
+#  без переменных окружения Redis, а пул настраивается по окружению уже запущенного процесса
+def is_shared_pool() -> bool:
+    return getenv('REDIS_SHARED_POOL', '0') == '1'
+
+
+@lru_cache(maxsize=None)
+def get_fsm_redis_client() -> InstrumentedRedis:
+    return create_redis_client(getenv('REDIS_FSM_DSN'), 'shared' if is_shared_pool() else 'fsm')
+
+
+@lru_cache(maxsize=None)
+def get_redis_client() -> InstrumentedRedis:
+    #  с общим пулом кэш живёт в той же базе, что и FSM, и отличается от её ключей префиксом
+    if is_shared_pool():
+        return get_fsm_redis_client()
+    return create_redis_client(getenv('REDIS_CACHE_DSN'), 'cache')
+
+
+def get_cache_key_prefix() -> str:
+    #  пустое значение из .env.example означает префикс по умолчанию
+    return getenv('REDIS_CACHE_PREFIX') or ('cache:' if is_shared_pool() else '')
@@ -0,0 +1,197 @@
+import struct
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+import redis.asyncio as async_redis
+from quiz import CompiledQuiz, QuizRegistry
+
+
+#  Сессия квиза хранится в хэше Redis с короткими полями:
+#    q, v         id и версия квиза, на которой сессия начата
+#    s0, s1, ...  баллы психотипов в порядке psychotypes_names квиза
+#    p            позиция текущего вопроса
+#    h            история ответов, по байту - индексу психотипа - на ответ
+#    m            id сообщения с вопросом
+#    r            id сообщений с результатом, упакованные int64
+#    t            время начала квиза, unix-время
+
+#  засчитывает ответ, сдвигает позицию и продлевает жизнь сессии за один запрос,
+#  возвращает всю сессию или nil, если её нет или у квиза нет такого психотипа
+RECORD_ANSWER_SCRIPT = """
+local score_field = 's' .. ARGV[1]
+if redis.call('HEXISTS', KEYS[1], score_field) == 0 then
+    return nil
+end
+redis.call('HINCRBY', KEYS[1], score_field, 1)
+redis.call('HINCRBY', KEYS[1], 'p', 1)
+local history = redis.call('HGET', KEYS[1], 'h') or ''
+redis.call('HSET', KEYS[1], 'h', history .. string.char(tonumber(ARGV[1])))
+if tonumber(ARGV[2]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return redis.call('HGETALL', KEYS[1])
+"""
+
+
+def pack_message_ids(message_ids) -> bytes:
+    return struct.pack(f'<{len(message_ids)}q', *message_ids)
+
+
+def unpack_message_ids(packed: bytes) -> tuple[int, ...]:
+    return struct.unpack(f'<{len(packed) // 8}q', packed)
+
+
+@dataclass
+class QuizSession:
+    quiz_id: str
+    quiz_version: int
+    scores: tuple[int, ...]
+    position: int = 0
+    history: bytes = b''
+    message_id: Optional[int] = None
+    result_message_ids: tuple[int, ...] = ()
+    started_at: int = field(default_factory=lambda: int(time.time()))
+
+    @classmethod
+    def new(cls, quiz: CompiledQuiz) -> 'QuizSession':
+        return cls(quiz_id=quiz.quiz_id, quiz_version=quiz.version, scores=(0, ) * len(quiz.psychotypes_names))
+
+    def encode(self) -> dict[str, bytes | int | str]:
+        fields = {f's{index}': score for index, score in enumerate(self.scores)}
+        fields.update(q=self.quiz_id, v=self.quiz_version, p=self.position, h=self.history, t=self.started_at)
+        if self.message_id is not None:
+            fields['m'] = self.message_id
+        if self.result_message_ids:
+            fields['r'] = pack_message_ids(self.result_message_ids)
+        return fields
+
+    @classmethod
+    def decode(cls, fields: dict[bytes, bytes]) -> 'QuizSession':
+        scores = []
+        while (score := fields.get(f's{len(scores)}'.encode())) is not None:
+            scores.append(int(score))
+
+        message_id = fields.get(b'm')
+        return cls(quiz_id=fields.get(b'q', b'').decode(),
+                   quiz_version=int(fields.get(b'v', 0)),
+                   scores=tuple(scores),
+                   position=int(fields.get(b'p', 0)),
+                   history=fields.get(b'h', b''),
+                   message_id=int(message_id) if message_id is not None else None,
+                   result_message_ids=unpack_message_ids(fields.get(b'r', b'')),
+                   started_at=int(fields.get(b't', 0)))
+
+    @classmethod
+    def from_legacy_data(cls, user_data: dict, quiz: CompiledQuiz) -> 'QuizSession':
+        """Сессия из старого JSON-словаря данных FSM"""
+
+        def parse_ids(message_ids) -> list[int]:
+            return [int(message_id) for message_id in str(message_ids or '').split()]
+
+        legacy_scores = user_data.get('scores', {})
+        message_ids = parse_ids(user_data.get('previous_message_id'))
+        return cls(quiz_id=quiz.quiz_id,
+                   quiz_version=quiz.version,
+                   scores=tuple(legacy_scores.get(psychotype, 0) for psychotype in quiz.psychotypes_names),
+                   position=user_data.get('current_question_position', 0),
+                   message_id=message_ids[-1] if message_ids else None,
+                   result_message_ids=tuple(message_ids[:-1] + parse_ids(user_data.get('result_message_ids'))))
+
+
+class SessionStore:
+    """Сессии квиза в Redis. Клиент должен возвращать bytes (decode_responses=False)"""
+
+    def __init__(self,
+                 redis_client: async_redis.Redis,
+                 quiz_registry: QuizRegistry,
+                 ttl: int = 7 * 24 * 3600,
+                 key_prefix: str = 'quiz:'):
+        self.redis_client = redis_client
+        self.quiz_registry = quiz_registry
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+        self._record_answer_script = redis_client.register_script(RECORD_ANSWER_SCRIPT)
+
+    def build_key(self, key: StorageKey) -> str:
+        return f'{self.key_prefix}{key.chat_id}:{key.user_id}'
+
+    async def save(self, state: FSMContext, session: QuizSession) -> None:
+        redis_key = self.build_key(state.key)
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.delete(redis_key)
+            pipe.hset(redis_key, mapping=session.encode())
+            if self.ttl:
+                pipe.expire(redis_key, self.ttl)
+            await pipe.execute()
+
+    async def replace(self, state: FSMContext, session: QuizSession) -> Optional[QuizSession]:
+        """Сохраняет новую сессию и возвращает прежнюю.
+
+        Чтение и замена идут одной транзакцией: id сообщений с результатом, которые отложенная
+        отправка дописывает вне блокировки апдейтов, попадают либо в прежнюю сессию, либо в новую.
+        """
+
+        redis_key = self.build_key(state.key)
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.hgetall(redis_key)
+            pipe.delete(redis_key)
+            pipe.hset(redis_key, mapping=session.encode())
+            if self.ttl:
+                pipe.expire(redis_key, self.ttl)
+            fields, *_ = await pipe.execute()
+
+        if fields:
+            return QuizSession.decode(fields)
+
+        user_data = await state.get_data()
+        if not user_data:
+            return None
+
+        await state.set_data({})
+        return QuizSession.from_legacy_data(user_data, self.quiz_registry.current())
+
+    async def _set_field(self, state: FSMContext, name: str, value: bytes | int) -> None:
+        redis_key = self.build_key(state.key)
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.hset(redis_key, name, value)
+            if self.ttl:
+                pipe.expire(redis_key, self.ttl)
+            await pipe.execute()
+
+    async def load(self, state: FSMContext) -> Optional[QuizSession]:
+        fields = await self.redis_client.hgetall(self.build_key(state.key))
+        if fields:
+            return QuizSession.decode(fields)
+        return await self.migrate_legacy(state)
+
+    async def record_answer(self, state: FSMContext, psychotype_index: int) -> QuizSession:
+        for _ in range(2):
+            fields = await self._record_answer_script(keys=[self.build_key(state.key)],
+                                                      args=[psychotype_index, self.ttl])
+            if fields is not None:
+                return QuizSession.decode(dict(zip(fields[::2], fields[1::2])))
+
+            if await self.migrate_legacy(state) is None:
+                break
+
+        raise KeyError(psychotype_index)
+
+    async def set_message_id(self, state: FSMContext, message_id: int) -> None:
+        await self._set_field(state, 'm', message_id)
+
+    async def set_result_message_ids(self, state: FSMContext, message_ids) -> None:
+        await self._set_field(state, 'r', pack_message_ids(message_ids))
+
+    async def migrate_legacy(self, state: FSMContext) -> Optional[QuizSession]:
+        """Переносит сессию из старых JSON-данных FSM, если они есть"""
+
+        user_data = await state.get_data()
+        if not user_data:
+            return None
+
+        session = QuizSession.from_legacy_data(user_data, self.quiz_registry.current())
+        await self.save(state, session)
+        await state.set_data({})
+        return session
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+import signal
+from typing import Collection, Optional
+
+
+logger = logging.getLogger()
+
+
+class Shutdown:
+    """Плавная остановка по SIGTERM/SIGINT.
+
+    После сигнала бот перестаёт принимать апдейты, а начатые хендлеры и очередь
+    исходящих запросов доделываются в пределах общего срока в timeout секунд.
+    """
+
+    def __init__(self, timeout: float = 20):
+        self.timeout = timeout
+        self._requested = asyncio.Event()
+        self._deadline: Optional[float] = None
+
+    def install_signal_handlers(self) -> None:
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.request, sig)
+
+    def request(self, sig: Optional[signal.Signals] = None) -> None:
+        if self._requested.is_set():
+            return
+        logger.warning('Shutdown requested%s, draining for up to %s s', f' by {sig.name}' if sig else '', self.timeout)
+        self._deadline = asyncio.get_running_loop().time() + self.timeout
+        self._requested.set()
+
+    @property
+    def is_requested(self) -> bool:
+        return self._requested.is_set()
+
+    async def wait(self) -> None:
+        await self._requested.wait()
+
+    async def sleep(self, seconds: float) -> None:
+        """Пауза, которая прерывается остановкой"""
+
+        try:
+            await asyncio.wait_for(self._requested.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    def remaining(self) -> float:
+        """Сколько осталось до срока; до сигнала - весь срок целиком"""
+
+        if self._deadline is None:
+            return self.timeout
+        return max(self._deadline - asyncio.get_running_loop().time(), 0)
+
+    async def drain(self, tasks: Collection[asyncio.Future], what: str = 'handlers') -> None:
+        """Ждёт задачи до срока, недождавшиеся отменяет"""
+
+        if not tasks:
+            return
+
+        _, pending = await asyncio.wait(tuple(tasks), timeout=self.remaining())
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.error('Shutdown deadline exceeded, %s unfinished %s cancelled', len(pending), what)
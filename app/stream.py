@@ -0,0 +1,133 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.types import TelegramObject, Update
+import redis.asyncio as async_redis
+from redis.exceptions import ResponseError
+from shutdown import Shutdown
+
+
+logger = logging.getLogger()
+
+
+class UpdatesPublisherMiddleware(BaseMiddleware):
+    """Вместо обработки складывает апдейты в общий Redis Stream для воркеров"""
+
+    def __init__(self, redis_client: async_redis.Redis, stream: str, maxlen: int = 100_000):
+        self.redis_client = redis_client
+        self.stream = stream
+        self.maxlen = maxlen
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+
+        chat = data.get('event_chat')
+        fields = {'chat': chat.id if chat else 0,
+                  'update': event.model_dump_json(exclude_unset=True)}
+        await self.redis_client.xadd(self.stream, fields, maxlen=self.maxlen, approximate=True)
+
+
+async def create_consumer_group(redis_client: async_redis.Redis, stream: str, group: str) -> None:
+    try:
+        await redis_client.xgroup_create(stream, group, id='0', mkstream=True)
+    except ResponseError as err:
+        if 'BUSYGROUP' not in str(err):
+            raise
+
+
+async def consume_updates(dp: Dispatcher,
+                          bot: Bot,
+                          redis_client: async_redis.Redis,
+                          stream: str,
+                          group: str,
+                          consumer: str,
+                          shutdown: Shutdown,
+                          batch_size: int = 100,
+                          max_concurrency: int = 100,
+                          claim_idle_ms: int = 60_000,
+                          block_ms: int = 1000) -> None:
+    """Читает апдейты из группы потребителей и скармливает их диспетчеру.
+
+    Чтение не ждёт, пока доделается прочитанное: апдейты одного чата выстраиваются
+    в цепочку и обрабатываются строго по очереди, разные чаты - параллельно, всего
+    не больше max_concurrency взятых в работу записей. Между воркерами одновременную
+    обработку одного чата исключает RedisEventIsolation диспетчера.
+    После сигнала остановки новые записи не читаются; записи, не доделанные к сроку,
+    остаются неподтверждёнными и достанутся другому воркеру через XAUTOCLAIM.
+    """
+
+    await create_consumer_group(redis_client, stream, group)
+
+    #  XREADGROUP дольше таймаута сокета клиент счёл бы обрывом соединения, и воркер упал бы
+    #  на первом же простое: блокировка всегда заметно короче REDIS_SOCKET_TIMEOUT
+    socket_timeout = redis_client.connection_pool.connection_kwargs.get('socket_timeout')
+    if socket_timeout:
+        block_ms = min(block_ms, int(socket_timeout * 1000) // 2)
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+    tasks: set[asyncio.Task] = set()
+    #  чат -> задача его последней взятой записи, следующая запись чата ждёт её
+    chat_tails: dict[Any, asyncio.Task] = {}
+    shutdown_waiter = asyncio.create_task(shutdown.wait())
+
+    async def process_entry(entry_id: bytes, fields: dict, chat: Any, previous: Optional[asyncio.Task]) -> None:
+        try:
+            if previous is not None:
+                #  исход предыдущей записи чата не важен, важен только порядок
+                await asyncio.wait((previous, ))
+            try:
+                update = Update.model_validate_json(fields[b'update'], context={'bot': bot})
+                await dp.feed_update(bot, update)
+            except Exception as err:
+                logger.error('Update %s from stream failed: %s', entry_id, err, exc_info=True)
+            #  отменённая по сроку остановки запись не подтверждается
+            await redis_client.xack(stream, group, entry_id)
+        finally:
+            semaphore.release()
+            if chat_tails.get(chat) is asyncio.current_task():
+                del chat_tails[chat]
+
+    async def acquire_slot() -> bool:
+        """Ждёт места под запись, False - если раньше пришёл сигнал остановки"""
+
+        if not semaphore.locked():
+            await semaphore.acquire()
+            return True
+
+        acquire = asyncio.create_task(semaphore.acquire())
+        await asyncio.wait((acquire, shutdown_waiter), return_when=asyncio.FIRST_COMPLETED)
+        if acquire.done():
+            return True
+        acquire.cancel()
+        return False
+
+    claim_start_id = '0-0'
+
+    try:
+        while not shutdown.is_requested:
+            #  забираем апдейты, зависшие у упавших воркеров
+            claim_start_id, entries, *_ = await redis_client.xautoclaim(stream, group, consumer,
+                                                                       min_idle_time=claim_idle_ms,
+                                                                       start_id=claim_start_id,
+                                                                       count=batch_size)
+            if not entries:
+                response = await redis_client.xreadgroup(group, consumer, {stream: '>'},
+                                                         count=batch_size, block=block_ms)
+                entries = response[0][1] if response else []
+
+            for entry_id, fields in entries:
+                if not await acquire_slot():
+                    break
+                chat = fields.get(b'chat')
+                task = asyncio.create_task(process_entry(entry_id, fields, chat, chat_tails.get(chat)))
+                chat_tails[chat] = task
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+    finally:
+        shutdown_waiter.cancel()
+        await shutdown.drain(tasks)
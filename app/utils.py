@@ -1,50 +1,26 @@
-import asyncio
 from contextlib import suppress
+from functools import partial
 
-from aiogram import html, types
+from aiogram import Bot
 from aiogram.exceptions import TelegramBadRequest
-from aiogram.fsm.context import FSMContext
-from aiogram.types import Message, InlineKeyboardMarkup
-from aiogram.utils.keyboard import InlineKeyboardBuilder
-from quiz import get_question_by_position, QUIZ_LEN
+from aiogram.types import Message
+from outbox import Outbox
+from quiz import CompiledQuiz
 
 
-NUMS_EMOJI = dict(zip(tuple(range(10)), ('0️⃣', '1️⃣', '2️⃣', '3️⃣', '4️⃣', '5️⃣', '6️⃣', '7️⃣', '8️⃣', '9️⃣')))
-
-
-def get_question_content(question_position: int) -> tuple[str, InlineKeyboardMarkup]:
-    question, answers = get_question_by_position(question_position)
-    question_num = html.italic(f'Вопрос {question_position + 1}/{QUIZ_LEN}')
-    question = html.bold(question)
-    hint = html.italic('Выберите вариант 1️⃣, 2️⃣ или 3️⃣, нажав на соответствующую кнопку ниже')
-    formatted_question = f'{question_num}\n\n{question}\n\n'
-
-    inline_keyboard = InlineKeyboardBuilder()
-
-    for index_, (role, answer) in enumerate(answers.items(), start=1):
-        formatted_question += f'{NUMS_EMOJI[index_]} {answer}\n'
-        inline_keyboard.add(types.InlineKeyboardButton(text=NUMS_EMOJI[index_],
-                                                       callback_data=f'{role}'))
-
-    formatted_question += f'\n{hint}'
-
-    return formatted_question, inline_keyboard.as_markup()
-
-
-async def collect_answer(answer: str,  state: FSMContext) -> None:
-    user_data = await state.get_data()
-    scores = user_data['scores']
-    scores[answer] += 1
-    await state.update_data(scores=scores)
+async def replace_old_question(message: Message,
+                               quiz: CompiledQuiz,
+                               next_question_index: int,
+                               previous_message_id: int) -> Message:
+    question, keyboard = quiz.get_question(next_question_index)
+    return await message.bot.edit_message_text(question, message.chat.id, previous_message_id, reply_markup=keyboard)
 
 
-async def replace_old_question(message: Message, next_question_index: int, previous_message_id: int) -> Message:
-    question, keyboard = get_question_content(next_question_index)
-    return await message.bot.edit_message_text(question, message.chat.id, previous_message_id, reply_markup=keyboard)
+async def delete_message(bot: Bot, chat_id: int, message_id: int) -> None:
+    with suppress(TelegramBadRequest):
+        await bot.delete_message(chat_id, message_id)
 
 
-async def del_previous_msg(msg_ids, message):
+def del_previous_msg(msg_ids, message: Message, outbox: Outbox) -> None:
     for msg_id in msg_ids:
-        await asyncio.sleep(0.33)
-        with suppress(TelegramBadRequest):
-            await message.bot.delete_message(message.chat.id, int(msg_id))
+        outbox.submit(message.chat.id, partial(delete_message, message.bot, message.chat.id, int(msg_id)))
@@ -0,0 +1,65 @@
+import asyncio
+from os import getenv
+from typing import Any, Dict
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+from shutdown import Shutdown
+
+
+class ConcurrencyLimitedRequestHandler(SimpleRequestHandler):
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, max_concurrency: int = 100, **kwargs: Any):
+        super().__init__(dispatcher, bot, **kwargs)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        #  задачи принятых апдейтов - их дожидается плавная остановка
+        self.tasks: set[asyncio.Task] = set()
+
+    async def _background_feed_update(self, bot: Bot, update: Dict[str, Any]) -> None:
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        try:
+            async with self.semaphore:
+                await super()._background_feed_update(bot, update)
+        finally:
+            self.tasks.discard(task)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, shutdown: Shutdown) -> None:
+    base_url = getenv('WEBHOOK_BASE_URL', '')
+    webhook_path = getenv('WEBHOOK_PATH', '/webhook')
+    secret_token = getenv('WEBHOOK_SECRET') or None
+    max_concurrency = int(getenv('WEBHOOK_MAX_CONCURRENCY', 100))
+
+    #  без секрета любой, кто достучится до порта, сможет подсовывать боту апдейты;
+    #  пустой секрет допустим только без регистрации у Telegram, для локальной проверки
+    if base_url and not secret_token:
+        raise ValueError('WEBHOOK_SECRET must be set when WEBHOOK_BASE_URL is set')
+
+    app = web.Application()
+    request_handler = ConcurrencyLimitedRequestHandler(dispatcher=dp,
+                                                       bot=bot,
+                                                       max_concurrency=max_concurrency,
+                                                       secret_token=secret_token)
+    request_handler.register(app, path=webhook_path)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, getenv('WEBHOOK_HOST', '0.0.0.0'), int(getenv('WEBHOOK_PORT', 8080)))
+    await site.start()
+
+    #  без публичного адреса вебхук у Telegram не регистрируется - так удобно
+    #  проверять бота локально, отправляя POST-запросы с апдейтами вручную
+    if base_url:
+        await bot.set_webhook(f'{base_url.rstrip("/")}{webhook_path}',
+                              secret_token=secret_token,
+                              max_connections=min(max_concurrency, 100),
+                              allowed_updates=dp.resolve_used_update_types())
+
+    try:
+        await shutdown.wait()
+        #  новые запросы больше не принимаются: Telegram повторит их, когда бот поднимется снова
+        await site.stop()
+        await shutdown.drain(request_handler.tasks)
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,51 @@
+"""Стоимость подготовки вопроса на один callback: рендер с нуля против скомпилированного квиза.
+
+Запуск из корня репозитория:  python benchmarks/bench_question_render.py [-n 20000]
+"""
+import argparse
+import json
+import sys
+import time
+from os import path
+
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), 'app'))
+
+from quiz import DEFAULT_QUIZ_ID, QUIZZES_FOLDER, load_quiz_file, render_question  # noqa: E402
+
+
+def measure(func, iterations: int, quiz_length: int) -> float:
+    started = time.process_time()
+    for i in range(iterations):
+        func(i % quiz_length)
+    return (time.process_time() - started) / iterations
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--iterations', type=int, default=20000)
+    parser.add_argument('--quiz-file', default=path.join(QUIZZES_FOLDER, f'{DEFAULT_QUIZ_ID}.json'))
+    args = parser.parse_args()
+
+    started = time.process_time()
+    quiz = load_quiz_file(args.quiz_file)
+    build_time = time.process_time() - started
+
+    with open(args.quiz_file, encoding='utf-8') as file:
+        raw_questions = json.load(file)['questions']
+
+    def render(position: int):
+        question = raw_questions[position]
+        return render_question(position, quiz.length, question['text'], question['answers'],
+                               quiz.psychotypes_names, quiz.texts['question_hint'])
+
+    before = measure(render, args.iterations, quiz.length)
+    after = measure(quiz.get_question, args.iterations, quiz.length)
+
+    print(f'quiz compile (once):   {build_time * 1e3:9.3f} ms')
+    print(f'render per callback:   {before * 1e6:9.3f} us CPU')
+    print(f'lookup per callback:   {after * 1e6:9.3f} us CPU')
+    print(f'speedup:               {before / after:9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
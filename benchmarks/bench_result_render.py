@@ -0,0 +1,85 @@
+"""Стоимость подготовки результата на одно завершение квиза: форматирование шаблонов
+и сборка клавиатуры заново против предкомпилированных кусков текста и кэша клавиатур.
+
+Запуск из корня репозитория:  python benchmarks/bench_result_render.py [-n 20000]
+"""
+import argparse
+import random
+import sys
+import time
+from os import path
+
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), 'app'))
+
+from aiogram import html  # noqa: E402
+from keyboards import get_url_button  # noqa: E402
+from quiz import CompiledQuiz, QuizRegistry  # noqa: E402
+
+
+def render_on_completion(quiz: CompiledQuiz, scores: tuple[int, ...], first_name: str):
+    """Путь завершения до предкомпиляции: всё форматируется на каждое завершение"""
+
+    ranked = sorted(zip(quiz.psychotypes_names, scores), key=lambda x: x[1], reverse=True)
+    max_score = ranked[0][1]
+
+    score_line = quiz.texts['score_line']
+    scored_psychotypes = '\n'.join(score_line.format(garden=quiz.psychotypes[psychotype]['garden'].title(),
+                                                     percent=(score * 100) // quiz.length)
+                                   for psychotype, score in ranked)
+
+    users_psychotype = quiz.psychotypes[random.choice(tuple(filter(lambda x: x[1] == max_score, ranked)))[0]]
+    p_s_ = quiz.texts['ps'].format(name=html.quote(first_name))
+    result = quiz.texts['result'].format(garden=users_psychotype['garden'],
+                                         description=users_psychotype['description'],
+                                         scores=scored_psychotypes)
+    keyboard = get_url_button.__wrapped__(quiz.texts['ps_button'], quiz.texts['ps_link'])
+    return result, p_s_, keyboard
+
+
+def render_precompiled(quiz: CompiledQuiz, scores: tuple[int, ...], first_name: str):
+    """Текущий путь завершения из handlers.answering"""
+
+    max_score = max(scores)
+    users_psychotype_index = random.choice([index for index, score in enumerate(scores) if score == max_score])
+    p_s_ = quiz.render_p_s(first_name)
+    result = quiz.render_result(users_psychotype_index, scores)
+    keyboard = get_url_button(quiz.texts['ps_button'], quiz.texts['ps_link'])
+    return result, p_s_, keyboard
+
+
+def make_scores(rnd: random.Random, quiz: CompiledQuiz) -> tuple[int, ...]:
+    scores = [0] * len(quiz.psychotypes_names)
+    for _ in range(quiz.length):
+        scores[rnd.randrange(len(scores))] += 1
+    return tuple(scores)
+
+
+def measure(func, quiz: CompiledQuiz, cases: list, iterations: int) -> float:
+    started = time.process_time()
+    for i in range(iterations):
+        func(quiz, *cases[i % len(cases)])
+    return (time.process_time() - started) / iterations
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    quiz_registry = QuizRegistry()
+    quiz_registry.load()
+    quiz = quiz_registry.current()
+
+    rnd = random.Random(0)
+    cases = [(make_scores(rnd, quiz), f'User <{index}>') for index in range(1000)]
+
+    before = measure(render_on_completion, quiz, cases, args.iterations)
+    after = measure(render_precompiled, quiz, cases, args.iterations)
+
+    print(f'format per completion:  {before * 1e6:9.3f} us CPU')
+    print(f'precompiled:            {after * 1e6:9.3f} us CPU')
+    print(f'speedup:                {before / after:9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Память на одну сессию квиза: старый JSON в данных FSM против компактного хэша.
+
+С настоящим Redis (лучше пустая база - она будет очищена):
+    python benchmarks/bench_session_memory.py --redis-url redis://localhost:6379/15 -n 10000
+Без --redis-url считается только размер полезных данных (fakeredis не знает MEMORY USAGE).
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+from os import path
+
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), 'app'))
+
+from aiogram.fsm.context import FSMContext  # noqa: E402
+from aiogram.fsm.storage.base import StorageKey  # noqa: E402
+from aiogram.fsm.storage.redis import RedisStorage  # noqa: E402
+from quiz import CompiledQuiz, QuizRegistry  # noqa: E402
+from session import QuizSession, SessionStore  # noqa: E402
+
+
+def make_legacy_data(rnd: random.Random, quiz: CompiledQuiz) -> dict:
+    answered = rnd.randint(0, quiz.length)
+    scores = dict.fromkeys(quiz.psychotypes_names, 0)
+    for _ in range(answered):
+        scores[rnd.choice(quiz.psychotypes_names)] += 1
+    return {'scores': scores,
+            'current_question_position': answered,
+            'previous_message_id': rnd.randint(10 ** 5, 10 ** 7)}
+
+
+def hash_payload_size(fields: dict) -> int:
+    return sum(len(str(name)) + len(value if isinstance(value, bytes) else str(value))
+               for name, value in fields.items())
+
+
+async def main(args: argparse.Namespace) -> None:
+    quiz_registry = QuizRegistry()
+    quiz_registry.load()
+    quiz = quiz_registry.current()
+
+    rnd = random.Random(0)
+    sessions = [make_legacy_data(rnd, quiz) for _ in range(args.sessions)]
+
+    legacy_payload = sum(len(json.dumps(data)) for data in sessions) / len(sessions)
+    compact_payload = sum(hash_payload_size(QuizSession.from_legacy_data(data, quiz).encode())
+                          for data in sessions) / len(sessions)
+
+    print(f'sessions:                   {len(sessions)}')
+    print(f'legacy JSON payload:        {legacy_payload:8.1f} bytes/session')
+    print(f'compact hash payload:       {compact_payload:8.1f} bytes/session')
+
+    if not args.redis_url:
+        return
+
+    storage = RedisStorage.from_url(args.redis_url)
+    session_store = SessionStore(storage.redis, quiz_registry)
+    redis_client = storage.redis
+    await redis_client.flushdb()
+
+    for index, data in enumerate(sessions):
+        await FSMContext(storage, StorageKey(bot_id=0, chat_id=index, user_id=index)).set_data(data)
+
+    legacy_keys = [key async for key in redis_client.scan_iter(match='fsm:*:data', count=1000)]
+    legacy_memory = sum([await redis_client.memory_usage(key) for key in legacy_keys]) / len(legacy_keys)
+
+    for index in range(len(sessions)):
+        await session_store.migrate_legacy(FSMContext(storage, StorageKey(bot_id=0, chat_id=index, user_id=index)))
+
+    compact_keys = [key async for key in redis_client.scan_iter(match='quiz:*', count=1000)]
+    compact_memory = sum([await redis_client.memory_usage(key) for key in compact_keys]) / len(compact_keys)
+
+    print(f'legacy JSON MEMORY USAGE:   {legacy_memory:8.1f} bytes/session')
+    print(f'compact hash MEMORY USAGE:  {compact_memory:8.1f} bytes/session')
+
+    await redis_client.flushdb()
+    await storage.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--sessions', type=int, default=1000)
+    parser.add_argument('--redis-url', default='')
+    asyncio.run(main(parser.parse_args()))
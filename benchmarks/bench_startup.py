@@ -0,0 +1,165 @@
+"""Холодный старт бота: время импорта модулей по -X importtime и время до первого апдейта -
+от запуска процесса до первого ответа пользователю через заглушку Bot API.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_startup.py [--runs 5] [--target 5.0]
+    python benchmarks/bench_startup.py --redis-url redis://localhost:6379/9
+
+Без --redis-url бот запускается с fakeredis (pip install "fakeredis[lua]"), его импорт
+входит в замер. Выход с кодом 1, если медиана времени до первого апдейта больше --target.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from os import path
+
+APP_DIR = path.join(path.dirname(path.dirname(path.abspath(__file__))), 'app')
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), 'loadtest'))
+
+from fake_api import FakeBotAPI  # noqa: E402
+
+
+#  бот целиком, но пулы Redis собраны на fakeredis - подменяется фабрика, к которой
+#  клиенты redis_db обращаются лениво, уже при запуске start_bot
+FAKEREDIS_BOOTSTRAP = '''
+import asyncio
+from fakeredis import FakeServer
+from fakeredis.aioredis import FakeConnection
+from redis.asyncio import ConnectionPool
+import redis_db
+from metrics import InstrumentedRedis
+
+server = FakeServer()
+redis_db.create_redis_client = lambda dsn, name: InstrumentedRedis(
+    connection_pool=ConnectionPool(connection_class=FakeConnection, server=server))
+
+import main
+asyncio.run(main.start_bot())
+'''
+
+
+def profile_imports(runs: int, top: int) -> None:
+    """Медиана полного импорта main и самые дорогие модули верхнего уровня последнего прогона"""
+
+    totals = []
+    modules = {}
+    for _ in range(runs):
+        #  переменных окружения Redis нет: импорт не должен их требовать
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'],
+                                cwd=APP_DIR, env={'PATH': os.environ.get('PATH', '')},
+                                capture_output=True, text=True, check=True)
+        #  модуль печатается после всех своих импортов, поэтому прямые импорты main -
+        #  строки следующего уровня вложенности между предыдущим модулем верхнего уровня и main
+        imported = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if not name.startswith('   '):
+                if name.strip() == 'main':
+                    totals.append(int(cumulative) / 1e6)
+                    modules = imported
+                imported = {}
+            elif not name.startswith('     '):
+                imported[name.strip()] = int(cumulative) / 1e6
+
+    print(f'import main:            {statistics.median(totals) * 1000:9.1f} ms (median of {runs})')
+    for name, seconds in sorted(modules.items(), key=lambda item: item[1], reverse=True)[:top]:
+        print(f'    {name:<30} {seconds * 1000:9.1f} ms')
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_update(update_id: int) -> dict:
+    user = {'id': 1_000_000, 'is_bot': False, 'first_name': 'User'}
+    return {'update_id': update_id,
+            'message': {'message_id': 1,
+                        'date': int(time.time()),
+                        'chat': {'id': user['id'], 'type': 'private', 'first_name': user['first_name']},
+                        'from': user,
+                        'text': '/start',
+                        'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}]}}
+
+
+async def time_to_first_update(api: FakeBotAPI, api_url: str, redis_url: str, workdir: str,
+                               timeout: float = 30) -> float:
+    #  offset поллинга в настоящем Redis переживает прогоны, поэтому id апдейта только растёт
+    api.updates = [start_update(time.time_ns() // 1000)]
+    api.first_response_time = None
+
+    env = {**os.environ,
+           'BOT_TOKEN': '42:startup-benchmark',
+           'TELEGRAM_API_URL': api_url,
+           'BOT_MODE': 'polling',
+           'BOT_ROLE': 'standalone',
+           'PYTHONPATH': APP_DIR}
+    env.pop('METRICS_PORT', None)
+    env.pop('PHOTO_CACHE_CHAT_ID', None)
+    if redis_url:
+        env.update(REDIS_FSM_DSN=redis_url, REDIS_CACHE_DSN=redis_url)
+        command = [sys.executable, path.join(APP_DIR, 'main.py')]
+    else:
+        command = [sys.executable, '-c', FAKEREDIS_BOOTSTRAP]
+
+    started = time.monotonic()
+    process = subprocess.Popen(command, cwd=workdir, env=env)
+    try:
+        while api.first_response_time is None:
+            if process.poll() is not None:
+                raise RuntimeError(f'bot exited with code {process.returncode}, see {workdir}/errors.txt')
+            if time.monotonic() - started > timeout:
+                raise TimeoutError(f'no response within {timeout} s')
+            await asyncio.sleep(0.005)
+        return api.first_response_time - started
+    finally:
+        process.send_signal(signal.SIGTERM)
+        await asyncio.to_thread(process.wait, timeout)
+
+
+async def run(args: argparse.Namespace) -> float:
+    port = free_port()
+    api = FakeBotAPI(latency=0)
+    runner = await api.start(port=port)
+
+    timings = []
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for _ in range(args.runs):
+                timings.append(await time_to_first_update(api, f'http://127.0.0.1:{port}', args.redis_url, workdir))
+    finally:
+        await runner.cleanup()
+
+    print(f'time to first update:   {statistics.median(timings) * 1000:9.1f} ms median, '
+          f'{min(timings) * 1000:.1f}..{max(timings) * 1000:.1f} ms over {args.runs} runs')
+    return statistics.median(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='сколько модулей показать в профиле импорта')
+    parser.add_argument('--target', type=float, default=5.0, help='цель по времени до первого апдейта, секунды')
+    parser.add_argument('--redis-url', default='', help='без него используется fakeredis')
+    args = parser.parse_args()
+
+    profile_imports(args.runs, args.top)
+    median = asyncio.run(run(args))
+
+    passed = median <= args.target
+    print(f'target:                 {args.target * 1000:9.1f} ms  {"OK" if passed else "FAILED"}')
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == '__main__':
+    main()
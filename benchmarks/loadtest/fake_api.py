@@ -0,0 +1,110 @@
+"""Заглушка Bot API для нагрузочных тестов.
+
+Отвечает на методы, которые вызывает бот, с настраиваемой задержкой и долей ответов 429.
+Запуск отдельно:  python benchmarks/loadtest/fake_api.py --port 8081 --latency 0.05 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+
+BOT_USER = {'id': 42, 'is_bot': True, 'first_name': 'Quiz bot', 'username': 'quiz_bot'}
+
+
+class FakeBotAPI:
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.5, error_rate: float = 0.0, retry_after: int = 1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.errors = Counter()
+        #  время первого запроса к API, кроме служебных - для замера времени до первого ответа пользователю
+        self.first_response_time = None
+        #  апдейты, которые отдаёт getUpdates - для замера запуска бота в режиме поллинга
+        self.updates: list[dict] = []
+        self._message_ids = itertools.count(1000)
+
+    def _message(self, chat_id: int, **fields) -> dict:
+        return {'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'group'},
+                'from': BOT_USER,
+                **fields}
+
+    def _result(self, method: str, params: dict):
+        chat_id = int(params.get('chat_id', 0))
+
+        if method == 'getMe':
+            return BOT_USER
+        if method in ('sendMessage', 'editMessageText'):
+            return self._message(chat_id, text=params.get('text', ''))
+        if method == 'sendPhoto':
+            photo = params.get('photo')
+            file_id = photo if isinstance(photo, str) else f'photo-{next(self._message_ids)}'
+            sizes = [{'file_id': f'{file_id}', 'file_unique_id': f'u{file_id}', 'width': width, 'height': width}
+                     for width in (90, 320, 800)]
+            return self._message(chat_id, photo=sizes, caption=params.get('caption', ''))
+        if method == 'getUpdates':
+            offset = int(params.get('offset') or 0)
+            return [update for update in self.updates if update['update_id'] >= offset]
+        return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        params = dict(await request.post())
+        self.calls[method] += 1
+
+        if self.latency:
+            await asyncio.sleep(random.uniform(self.latency * (1 - self.jitter), self.latency * (1 + self.jitter)))
+
+        if method not in ('getMe', 'deleteWebhook', 'getUpdates') and random.random() < self.error_rate:
+            self.errors[method] += 1
+            return web.json_response({'ok': False,
+                                      'error_code': 429,
+                                      'description': f'Too Many Requests: retry after {self.retry_after}',
+                                      'parameters': {'retry_after': self.retry_after}})
+
+        if self.first_response_time is None and method not in ('getMe', 'deleteWebhook', 'getUpdates'):
+            self.first_response_time = time.monotonic()
+
+        result = self._result(method, params)
+        if method == 'getUpdates' and not result:
+            #  long polling: пустой ответ не сразу, чтобы бот не крутил запросы вхолостую
+            await asyncio.sleep(min(float(params.get('timeout') or 0), 0.5))
+
+        return web.json_response({'ok': True, 'result': result})
+
+    def make_app(self) -> web.Application:
+        #  картинки квиза больше стандартного лимита aiohttp в 1 МБ
+        app = web.Application(client_max_size=50 * 1024 ** 2)
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        return app
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8081) -> web.AppRunner:
+        runner = web.AppRunner(self.make_app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    api = FakeBotAPI(latency=args.latency, error_rate=args.error_rate)
+    web.run_app(api.make_app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
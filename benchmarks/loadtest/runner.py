@@ -0,0 +1,214 @@
+"""Нагрузочный прогон настоящего handlers.router через Dispatcher против заглушки Bot API.
+
+Примеры:
+    python benchmarks/loadtest/runner.py --users 200 --speed 20
+    python benchmarks/loadtest/runner.py --trace trace.json --redis-url redis://localhost:6379/9 --error-rate 0.01
+
+Без --redis-url используется fakeredis (pip install "fakeredis[lua]").
+"""
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import sys
+import time
+import os
+from os import path
+
+APP_DIR = path.join(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))), 'app')
+sys.path.insert(0, APP_DIR)
+
+from aiogram import Bot, Dispatcher  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+from aiogram.enums import ParseMode  # noqa: E402
+from aiogram.fsm.storage.memory import SimpleEventIsolation  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+from aiogram.utils.callback_answer import CallbackAnswerMiddleware  # noqa: E402
+from redis.asyncio import ConnectionPool  # noqa: E402
+
+from fake_api import FakeBotAPI  # noqa: E402
+from traces import generate_trace  # noqa: E402
+from analytics import Analytics, SQLiteAnalyticsSink  # noqa: E402
+from handlers import router  # noqa: E402
+from metrics import InstrumentedPipeline, InstrumentedRedis  # noqa: E402
+from middlewares import RedisBatchMiddleware, ThrottlingMiddleware  # noqa: E402
+from outbox import Outbox  # noqa: E402
+from photos import PhotoCache  # noqa: E402
+from ratelimit import RateLimitRequestMiddleware  # noqa: E402
+from quiz import QuizRegistry  # noqa: E402
+from redis_batch import BatchingRedisStorage  # noqa: E402
+from session import SessionStore  # noqa: E402
+
+
+class CountingPipeline(InstrumentedPipeline):
+
+    async def execute(self, raise_on_error: bool = True):
+        CountingRedis.commands += len(self.command_stack)
+        CountingRedis.round_trips += 1
+        return await super().execute(raise_on_error)
+
+
+class CountingRedis(InstrumentedRedis):
+    """Считает все команды, включая отправленные пайплайнами, и запросы к Redis"""
+
+    commands = 0
+    round_trips = 0
+
+    async def execute_command(self, *args, **options):
+        CountingRedis.commands += 1
+        CountingRedis.round_trips += 1
+        return await super().execute_command(*args, **options)
+
+    def pipeline(self, transaction: bool = True, shard_hint=None) -> CountingPipeline:
+        return CountingPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class CountingLogHandler(logging.Handler):
+    records = 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        CountingLogHandler.records += 1
+
+
+def make_redis(redis_url: str, fake_server, **kwargs) -> CountingRedis:
+    if redis_url:
+        return CountingRedis.from_url(redis_url, **kwargs)
+
+    from fakeredis.aioredis import FakeConnection
+    return CountingRedis(connection_pool=ConnectionPool(connection_class=FakeConnection, server=fake_server, **kwargs))
+
+
+def percentile(values: list[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+async def run(args: argparse.Namespace) -> dict:
+    quiz_registry = QuizRegistry()
+    quiz_registry.load()
+
+    if args.trace:
+        with open(args.trace, encoding='utf-8') as file:
+            trace = json.load(file)
+    else:
+        trace = generate_trace(args.users, args.think_time, args.arrival_window, quiz_registry=quiz_registry)
+
+    fake_api = FakeBotAPI(latency=args.latency, error_rate=args.error_rate)
+    api_runner = await fake_api.start(port=args.api_port)
+
+    fake_server = None
+    if not args.redis_url:
+        from fakeredis import FakeServer
+        fake_server = FakeServer()
+
+    fsm_redis = make_redis(args.redis_url, fake_server)
+    cache_redis = fsm_redis if args.shared_pool else make_redis(args.redis_url, fake_server)
+    cache_key_prefix = 'cache:' if args.shared_pool else ''
+    if args.redis_url:
+        await cache_redis.flushdb()
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f'http://127.0.0.1:{args.api_port}'))
+    session.middleware(RateLimitRequestMiddleware(global_rate=args.global_rate))
+    bot = Bot('42:loadtest', session=session, parse_mode=ParseMode.HTML)
+
+    outbox = Outbox()
+    analytics = Analytics(SQLiteAnalyticsSink(args.analytics_db) if args.analytics_db else None)
+    analytics.start()
+    dp = Dispatcher(events_isolation=SimpleEventIsolation(),
+                    storage=BatchingRedisStorage(redis=fsm_redis),
+                    redis_client=cache_redis,
+                    photo_cache=PhotoCache(cache_redis, key_prefix=f'{cache_key_prefix}photo:'),
+                    session_store=SessionStore(fsm_redis, quiz_registry),
+                    quiz_registry=quiz_registry,
+                    outbox=outbox,
+                    analytics=analytics)
+    dp.callback_query.middleware(CallbackAnswerMiddleware())
+    messages_throttling = ThrottlingMiddleware(cache_redis, key_prefix=f'{cache_key_prefix}throttle:message:')
+    dp.message.middleware(messages_throttling)
+    if args.shared_pool:
+        dp.update.outer_middleware.unregister(dp.fsm)
+        dp.update.outer_middleware(RedisBatchMiddleware({'message': messages_throttling}))
+        dp.update.outer_middleware(dp.fsm)
+    dp.include_routers(router)
+
+    logging.getLogger().addHandler(CountingLogHandler(logging.ERROR))
+
+    latencies = []
+
+    async def feed(update: Update) -> None:
+        started = time.perf_counter()
+        await dp.feed_update(bot, update)
+        latencies.append(time.perf_counter() - started)
+
+    tasks = []
+    CountingRedis.commands = 0
+    CountingRedis.round_trips = 0
+    started = time.monotonic()
+
+    for item in trace:
+        delay = started + item['at'] / args.speed - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        update = Update.model_validate(item['update'], context={'bot': bot})
+        tasks.append(asyncio.create_task(feed(update)))
+
+    await asyncio.gather(*tasks)
+    handled_time = time.monotonic() - started
+    await outbox.close()
+    await analytics.close()
+    total_time = time.monotonic() - started
+
+    #  повторы после 429 - тоже вызовы sendPhoto, завершённый квиз - только успешная отправка результата
+    completed = fake_api.calls['sendPhoto'] - fake_api.errors['sendPhoto']
+    report = {'updates': len(trace),
+              'updates_per_sec': len(trace) / handled_time,
+              'handler_p50_ms': statistics.median(latencies) * 1000,
+              'handler_p99_ms': percentile(latencies, 99) * 1000,
+              'completed_quizzes': completed,
+              'redis_ops_per_completed_quiz': CountingRedis.commands / completed if completed else None,
+              'redis_round_trips_per_quiz': CountingRedis.round_trips / completed if completed else None,
+              'handler_errors': CountingLogHandler.records,
+              'outbox_drain_sec': total_time - handled_time,
+              'api_calls': dict(fake_api.calls),
+              'api_429': dict(fake_api.errors),
+              'analytics_events': dict(analytics.counters)}
+
+    await bot.session.close()
+    await dp.storage.close()
+    await cache_redis.aclose()
+    await api_runner.cleanup()
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--trace', help='JSON-трасса от traces.py, иначе генерируется на лету')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--think-time', type=float, default=2.0)
+    parser.add_argument('--arrival-window', type=float, default=10.0)
+    parser.add_argument('--speed', type=float, default=1.0, help='во сколько раз ускорить воспроизведение трассы')
+    parser.add_argument('--latency', type=float, default=0.05, help='средняя задержка ответа Bot API, секунды')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов 429')
+    parser.add_argument('--global-rate', type=float, default=30, help='глобальный лимит запросов к Bot API в секунду')
+    parser.add_argument('--api-port', type=int, default=8081)
+    parser.add_argument('--redis-url', default='', help='без него используется fakeredis')
+    parser.add_argument('--shared-pool', action='store_true', help='кэш и FSM в одном клиенте, как REDIS_SHARED_POOL=1')
+    parser.add_argument('--analytics-db', default='', help='файл SQLite для событий квиза, без него они не пишутся')
+    args = parser.parse_args()
+
+    #  бот запускается из папки app, относительно неё заданы пути к картинкам
+    if args.trace:
+        args.trace = path.abspath(args.trace)
+    os.chdir(APP_DIR)
+
+    report = asyncio.run(run(args))
+    for key, value in report.items():
+        print(f'{key:30} {value:.2f}' if isinstance(value, float) else f'{key:30} {value}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Генератор потока апдейтов: N пользователей проходят квиз от /start до последнего ответа.
+
+Сохранить трассу:  python benchmarks/loadtest/traces.py --users 500 -o trace.json
+Трасса - список {"at": секунды от начала, "update": апдейт в формате Bot API}.
+"""
+import argparse
+import itertools
+import json
+import random
+import sys
+from os import path
+
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))), 'app'))
+
+from quiz import QuizRegistry  # noqa: E402
+
+
+def _user(user_id: int) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}'}
+
+
+def _chat(user_id: int) -> dict:
+    return {'id': user_id, 'type': 'private', 'first_name': f'User {user_id}'}
+
+
+def generate_trace(users: int,
+                   think_time: float = 2.0,
+                   arrival_window: float = 10.0,
+                   first_user_id: int = 1_000_000,
+                   seed: int = 0,
+                   quiz_registry: QuizRegistry = None) -> list[dict]:
+    """Время раздумий над вопросом - логнормальное с медианой think_time секунд,
+    пользователи приходят равномерно в течение arrival_window секунд.
+    Ответы - индексы психотипов текущей версии квиза по умолчанию"""
+
+    if quiz_registry is None:
+        quiz_registry = QuizRegistry()
+        quiz_registry.load()
+    quiz = quiz_registry.current()
+    answers = tuple(str(index) for index in range(len(quiz.psychotypes_names)))
+
+    rnd = random.Random(seed)
+    update_ids = itertools.count(1)
+    callback_ids = itertools.count(1)
+    trace = []
+
+    for user_id in range(first_user_id, first_user_id + users):
+        at = rnd.uniform(0, arrival_window)
+        trace.append({'at': at,
+                      'update': {'update_id': 0,
+                                 'message': {'message_id': 1,
+                                             'date': int(at),
+                                             'chat': _chat(user_id),
+                                             'from': _user(user_id),
+                                             'text': '/start',
+                                             'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}]}}})
+
+        for data in ('start', *(rnd.choice(answers) for _ in range(quiz.length))):
+            at += rnd.lognormvariate(0, 0.5) * think_time
+            trace.append({'at': at,
+                          'update': {'update_id': 0,
+                                     'callback_query': {'id': str(next(callback_ids)),
+                                                        'chat_instance': str(user_id),
+                                                        'from': _user(user_id),
+                                                        'message': {'message_id': 2,
+                                                                    'date': int(at),
+                                                                    'chat': _chat(user_id),
+                                                                    'text': 'question'},
+                                                        'data': data}}})
+
+    trace.sort(key=lambda item: item['at'])
+    for item in trace:
+        item['update']['update_id'] = next(update_ids)
+
+    return trace
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--think-time', type=float, default=2.0)
+    parser.add_argument('--arrival-window', type=float, default=10.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default='-')
+    args = parser.parse_args()
+
+    trace = generate_trace(args.users, args.think_time, args.arrival_window, seed=args.seed)
+
+    if args.output == '-':
+        json.dump(trace, sys.stdout, ensure_ascii=False)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(trace, file, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Отчёт по ответам квиза: распределения ответов по вопросам, доли психотипов,
+отвал на каждом вопросе и время прохождения.
+
+С хранилищем sqlite:  ANALYTICS_SQLITE_PATH=app/analytics.sqlite3 python scripts/analytics_report.py
+С хранилищем redis новые записи потока сначала дописываются в свёртки локальной базы:
+    python scripts/analytics_report.py --redis-url redis://localhost:6379/1 --stream analytics --db analytics.sqlite3
+"""
+import argparse
+import asyncio
+import sys
+from os import getenv, path
+
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), 'app'))
+
+import redis.asyncio as async_redis  # noqa: E402
+from analytics import AnalyticsDB, ingest_stream  # noqa: E402
+from quiz import DEFAULT_QUIZ_ID, QUIZZES_FOLDER, CompiledQuiz, QuizRegistry  # noqa: E402
+
+
+def percent(part: int, total: int) -> str:
+    return f'{part * 100 / total:5.1f}%' if total else '    -'
+
+
+def format_seconds(seconds) -> str:
+    return '-' if seconds is None else f'{seconds:.0f}s'
+
+
+def print_report(report: dict, quiz: CompiledQuiz = None) -> None:
+    def psychotype_name(index: int) -> str:
+        if quiz is not None and 0 <= index < len(quiz.psychotypes_names):
+            return quiz.psychotypes_names[index]
+        return str(index)
+
+    started, completed = report['started'], report['completed']
+    print(f"== {report['quiz_id']} v{report['quiz_version']}: "
+          f"started {started}, completed {completed} ({percent(completed, started).strip()})")
+
+    print('answers by question:')
+    for position, counts in sorted(report['answers'].items()):
+        answered = sum(counts.values())
+        distribution = ', '.join(f'{psychotype_name(psychotype)} {percent(count, answered).strip()}'
+                                 for psychotype, count in sorted(counts.items()))
+        print(f'  {position + 1:>3}  {answered:>8}  {distribution}')
+
+    print('drop-off by question:')
+    reached = started
+    for position, dropped in report['drop_off'].items():
+        print(f'  {position + 1:>3}  {dropped:>8}  {percent(dropped, reached)}')
+        reached -= dropped
+
+    print('psychotypes:')
+    for psychotype, count in report['results'].most_common():
+        print(f'  {psychotype_name(psychotype):<12} {count:>8}  {percent(count, completed)}')
+
+    print(f"completion time: mean {format_seconds(report['duration_mean'])}, "
+          f"median <= {format_seconds(report['duration_median'])}, p90 <= {format_seconds(report['duration_p90'])}")
+    print()
+
+
+async def main(args: argparse.Namespace) -> None:
+    db = AnalyticsDB(args.db)
+
+    if args.redis_url:
+        redis_client = async_redis.Redis.from_url(args.redis_url)
+        ingested = await ingest_stream(redis_client, args.stream, db)
+        await redis_client.aclose()
+        print(f'ingested events: {ingested}\n')
+
+    quiz_registry = QuizRegistry(getenv('QUIZZES_FOLDER') or QUIZZES_FOLDER, getenv('DEFAULT_QUIZ') or DEFAULT_QUIZ_ID)
+    quiz_registry.load()
+
+    for report in db.report(args.quiz):
+        quiz = quiz_registry.get(report['quiz_id'], report['quiz_version'])
+        #  названия психотипов - только если эта версия квиза ещё лежит в папке
+        if (quiz.quiz_id, quiz.version) != (report['quiz_id'], report['quiz_version']):
+            quiz = None
+        print_report(report, quiz)
+
+    db.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', default=getenv('ANALYTICS_SQLITE_PATH', 'analytics.sqlite3'))
+    parser.add_argument('--redis-url', default='')
+    parser.add_argument('--stream', default=getenv('ANALYTICS_STREAM', 'analytics'))
+    parser.add_argument('--quiz', default=None)
+    asyncio.run(main(parser.parse_args()))
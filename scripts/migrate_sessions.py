@@ -0,0 +1,38 @@
+"""Перенос сессий квиза из старых JSON-данных FSM в компактные хэши.
+
+Бот переносит сессии и сам, при первом обращении пользователя; скрипт делает это
+для всех ключей сразу.  Запуск:  REDIS_FSM_DSN=redis://localhost:6379/2 python scripts/migrate_sessions.py
+"""
+import asyncio
+import sys
+from os import getenv, path
+
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), 'app'))
+
+from aiogram.fsm.context import FSMContext  # noqa: E402
+from aiogram.fsm.storage.base import StorageKey  # noqa: E402
+from aiogram.fsm.storage.redis import RedisStorage  # noqa: E402
+from quiz import DEFAULT_QUIZ_ID, QUIZZES_FOLDER, QuizRegistry  # noqa: E402
+from session import SessionStore  # noqa: E402
+
+
+async def migrate_sessions() -> None:
+    storage = RedisStorage.from_url(getenv('REDIS_FSM_DSN'))
+    quiz_registry = QuizRegistry(getenv('QUIZZES_FOLDER') or QUIZZES_FOLDER, getenv('DEFAULT_QUIZ') or DEFAULT_QUIZ_ID)
+    quiz_registry.load()
+    session_store = SessionStore(storage.redis, quiz_registry, ttl=int(getenv('SESSION_TTL', 7 * 24 * 3600)))
+    migrated = 0
+
+    #  ключи DefaultKeyBuilder по умолчанию: fsm:<chat_id>:<user_id>:data
+    async for redis_key in storage.redis.scan_iter(match='fsm:*:data', count=1000):
+        _, chat_id, user_id, _ = redis_key.decode().split(':')
+        state = FSMContext(storage, StorageKey(bot_id=0, chat_id=int(chat_id), user_id=int(user_id)))
+        if await session_store.migrate_legacy(state) is not None:
+            migrated += 1
+
+    await storage.close()
+    print(f'migrated sessions: {migrated}')
+
+
+if __name__ == '__main__':
+    asyncio.run(migrate_sessions())
@@ -0,0 +1,39 @@
+"""Отправка записанных апдейтов в локально запущенного бота в режиме вебхука.
+
+Пример:  python scripts/post_updates.py scripts/updates/*.json --url http://localhost:8080/webhook --secret s3cr3t
+Файл может содержать один апдейт (объект) или список апдейтов.
+"""
+import argparse
+import asyncio
+import json
+
+from aiohttp import ClientSession
+
+
+async def post_updates(url: str, secret: str, files: list[str]) -> None:
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+
+    async with ClientSession(headers=headers) as session:
+        for file_name in files:
+            with open(file_name, encoding='utf-8') as file:
+                updates = json.load(file)
+
+            if isinstance(updates, dict):
+                updates = [updates]
+
+            for update in updates:
+                async with session.post(url, json=update) as response:
+                    print(f'{file_name}: update {update.get("update_id")} -> {response.status}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--url', default='http://localhost:8080/webhook')
+    parser.add_argument('--secret', default='')
+    args = parser.parse_args()
+    asyncio.run(post_updates(args.url, args.secret, args.files))
+
+
+if __name__ == '__main__':
+    main()